@@ -0,0 +1,260 @@
+# By: Benjamin Goebel
+# Date: August 24th, 2017
+# Description: This program generates synthetic Batters sheets of any size and
+#              benchmarks the BaseballAnalytics program against them.
+
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+TEAMS = ['AZ', 'ATL', 'BAL', 'BOS', 'CHC', 'CHW', 'CIN', 'CLE', 'COL', 'DET', \
+         'MIA', 'HOU', 'KC', 'LAA', 'LAD', 'MIL', 'MIN', 'NYY', 'NYM', 'OAK', \
+         'PHI', 'PIT', 'SD', 'SF', 'SEA', 'STL', 'TB', 'TEX', 'TOR', 'WSH', \
+         'FA']
+POSITIONS = ['C', '1B', '2B', '3B', 'SS', 'LF', 'CF', 'RF', 'DH']
+SYLLABLES = ['ab', 'ar', 'ba', 'bel', 'car', 'da', 'del', 'er', 'fra', 'gar', \
+             'go', 'her', 'is', 'jo', 'ka', 'lo', 'ma', 'mar', 'ne', 'on', \
+             'pe', 'ra', 'ro', 'san', 'son', 'ta', 'to', 'va', 'wil', 'zo']
+
+# Purpose: Loads the BaseballAnalytics program (baseball-stats.py, which
+#          cannot be imported by name) as a module.
+# Arguments: None.
+# Returns: A module: the program.
+def load_program():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+                        'baseball-stats.py')
+    spec = importlib.util.spec_from_file_location('baseball_stats', path)
+    program = importlib.util.module_from_spec(spec)
+    sys.modules['baseball_stats'] = program
+    spec.loader.exec_module(program)
+    return program
+
+# Purpose: Generates random names from syllables.
+# Arguments: A numpy Generator: the random numbers. An int: the number of
+#            names.
+# Returns: A numpy array of strings: the names.
+def generate_names(rng, num_names):
+    syllables = np.array(SYLLABLES, dtype = object)
+    names = syllables[rng.integers(0, len(SYLLABLES), num_names)]
+    for i in range(rng.integers(1, 3)):
+        names = names + syllables[rng.integers(0, len(SYLLABLES), num_names)]
+    return np.array([name.title() for name in names], dtype = object)
+
+# Purpose: Generates a synthetic Batters sheet with the same columns as the
+#          real one. The counting stats are consistent with each other (e.g.
+#          hits never exceed at bats), and the rate stats are computed from
+#          them.
+# Arguments: An int: the number of rows. An int: the random seed.
+# Returns: A DataFrame: the synthetic Batters sheet.
+def generate_batters(num_rows, seed = 2016):
+    rng = np.random.default_rng(seed)
+    last = generate_names(rng, num_rows)
+    first = generate_names(rng, num_rows)
+    games = rng.integers(1, 163, num_rows)
+    at_bats = rng.binomial(games * 4, 0.9)
+    hits = rng.binomial(at_bats, 0.25)
+    doubles = rng.binomial(hits, 0.2)
+    triples = rng.binomial(hits - doubles, 0.02)
+    home_runs = rng.binomial(hits - doubles - triples, 0.12)
+    walks = rng.binomial(at_bats, 0.08)
+    strikeouts = rng.binomial(at_bats, 0.22)
+    stolen = rng.binomial(games, 0.05)
+    caught = rng.binomial(stolen + 1, 0.25)
+    runs = rng.binomial(hits + walks, 0.4)
+    rbis = rng.binomial(hits + home_runs, 0.45)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        average = np.where(at_bats > 0, hits / at_bats, 0.0)
+        slugging = np.where(at_bats > 0, (hits + doubles + 2 * triples + \
+                                          3 * home_runs) / at_bats, 0.0)
+        on_base = np.where(at_bats + walks > 0, (hits + walks) / \
+                           (at_bats + walks), 0.0)
+    return pd.DataFrame({'PLAYER': last + ', ' + first,
+                         'POS': np.array(POSITIONS)[rng.integers(\
+                                0, len(POSITIONS), num_rows)],
+                         'Team': np.array(TEAMS)[rng.integers(\
+                                 0, len(TEAMS), num_rows)],
+                         'G': games, 'AB': at_bats, 'R': runs, 'H': hits,
+                         '2B': doubles, '3B': triples, 'HR': home_runs,
+                         'RBI': rbis, 'BB': walks, 'K': strikeouts,
+                         'SB': stolen, 'CS': caught, 'AVG': average,
+                         'SLG': slugging, 'OBP': on_base,
+                         'OPS': on_base + slugging})
+
+# Purpose: Writes a synthetic workbook (a Batters sheet) and its columnar
+#          cache, unless the workbook already exists.
+# Arguments: A module: the program. An int: the number of rows. A string:
+#            the output directory.
+# Returns: A string: the workbook's path.
+def write_workbook(program, num_rows, data_dir):
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+    workbook = os.path.join(data_dir, "batters-%d.xlsx" % num_rows)
+    if not os.path.exists(workbook):
+        generate_batters(num_rows).to_excel(workbook, sheet_name = 'Batters', \
+                                            index = False)
+    program.load_batter_stats(workbook, 'Batters', True)
+    return workbook
+
+# Purpose: Times a function.
+# Arguments: A function: the function to time (called with no arguments).
+#            An int: the number of calls.
+# Returns: A dictionary: the total seconds, seconds per call, calls per
+#          second and the peak memory (in bytes) traced during one more call.
+def time_calls(function, num_calls):
+    start = time.perf_counter()
+    for i in range(num_calls):
+        function()
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'calls': num_calls,
+            'seconds': seconds,
+            'seconds_per_call': seconds / num_calls,
+            'calls_per_second': num_calls / seconds if seconds else None,
+            'peak_bytes': peak}
+
+# Purpose: Benchmarks every public BaseballAnalytics query on one workbook.
+# Arguments: A module: the program. A string: the workbook. An int: the
+#            number of calls per query. A string: where charts are rendered
+#            (None skips rendering).
+# Returns: A dictionary: each benchmark's name with its timings.
+def benchmark_workbook(program, workbook, num_calls, chart_dir):
+    results = {}
+    results['__init__ (excel)'] = time_calls(\
+        lambda: program.BaseballAnalytics(workbook, False), 1)
+    results['__init__ (cache)'] = time_calls(\
+        lambda: program.BaseballAnalytics(workbook, True), 3)
+    ba = program.BaseballAnalytics(workbook, True)
+    players = ba.get_player_percentiles().index
+    rng = np.random.default_rng(0)
+    sample = [players[i] for i in rng.integers(0, len(players), num_calls)]
+    names = itertools.cycle(sample)
+    queries = {'get_player_stats': lambda: ba.get_player_stats(\
+                   *next(names).split(', ', 1)),
+               'get_player_quantile': lambda: ba.get_player_quantile(\
+                   *next(names).split(', ', 1)),
+               'get_player_percentiles': lambda: ba.get_player_percentiles(),
+               'get_quantile_stat': lambda: ba.get_quantile_stat('HR', 0.99),
+               'get_top_players': lambda: ba.get_top_players('HR', 10),
+               'get_max_stat_player': lambda: ba.get_max_stat_player('OPS'),
+               'get_mean_stat': lambda: ba.get_mean_stat('AVG'),
+               'get_median_stat': lambda: ba.get_median_stat('AVG'),
+               'get_std_stat': lambda: ba.get_std_stat('AVG'),
+               'get_avg_team_stats': lambda: ba.get_avg_team_stats(),
+               'get_med_team_stats': lambda: ba.get_med_team_stats(),
+               'get_std_team_stats': lambda: ba.get_std_team_stats(),
+               'get_team_roster': lambda: ba.get_team_roster('BOS'),
+               'find_players': lambda: ba.find_players('Ma'),
+               'search_players': lambda: ba.search_players('Marsan, Jo')}
+    for name in sorted(queries):
+        results[name] = time_calls(queries[name], num_calls)
+    if chart_dir is not None:
+        specs = ba.get_chart_specs('team-by-stat')
+        results['render_charts'] = time_calls(\
+            lambda: ba.render_charts(specs, chart_dir, 'png', 1), 1)
+    return results
+
+# Purpose: Compares benchmark results with an earlier run.
+# Arguments: A dictionary: the results. A dictionary: the earlier results.
+#            A float: the slowdown (e.g. 0.2 for 20%) counted as a
+#            regression.
+# Returns: A list of strings: a line per regression.
+def compare_results(results, baseline, threshold):
+    regressions = []
+    for size, benchmarks in results['sizes'].items():
+        for name, timings in benchmarks.items():
+            try:
+                before = baseline['sizes'][size][name]['seconds_per_call']
+            except KeyError:
+                continue
+            after = timings['seconds_per_call']
+            if before > 0 and after > before * (1 + threshold):
+                regressions.append(("%s rows, %s: %.6fs -> %.6fs " + \
+                                    "(%+.0f%%)") % (size, name, before, \
+                                    after, 100 * (after / before - 1)))
+    return regressions
+
+# Purpose: Prints benchmark results as a table.
+# Arguments: A dictionary: the results.
+# Returns: Nothing.
+def print_results(results):
+    for size, benchmarks in results['sizes'].items():
+        print("%s rows" % size)
+        for name, timings in benchmarks.items():
+            print(("  %-26s %12.6f s/call %12.1f calls/s %10.1f MB peak") % \
+                  (name, timings['seconds_per_call'], \
+                   timings['calls_per_second'] or 0.0, \
+                   timings['peak_bytes'] / 1e6))
+
+# Purpose: Runs and controls the benchmark program.
+# Arguments: A list of strings: the command line arguments (defaults to
+#            sys.argv).
+# Returns: An int: the exit status (1 if a regression was found).
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmarks the " + \
+                                     "BaseballAnalytics program on " + \
+                                     "synthetic Batters sheets.")
+    parser.add_argument('--sizes', type = int, nargs = '+', \
+                        default = [1000, 10000, 100000], \
+                        help = "the numbers of rows to benchmark " + \
+                        "(up to 1000000)")
+    parser.add_argument('--calls', type = int, default = 100, \
+                        help = "the number of calls per query")
+    parser.add_argument('--data-dir', default = 'benchmarks/data', \
+                        help = "where the synthetic workbooks are written")
+    parser.add_argument('--results-dir', default = 'benchmarks/results', \
+                        help = "where the results are stored")
+    parser.add_argument('--no-charts', action = 'store_true', \
+                        help = "skip the chart rendering benchmark")
+    parser.add_argument('--compare', metavar = 'FILE', \
+                        help = "an earlier results file to compare against")
+    parser.add_argument('--threshold', type = float, default = 0.2, \
+                        help = "the slowdown counted as a regression")
+    parser.add_argument('--generate-only', action = 'store_true', \
+                        help = "only write the synthetic workbooks")
+    args = parser.parse_args(argv)
+    program = load_program()
+    results = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'calls': args.calls,
+               'sizes': {}}
+    for size in args.sizes:
+        workbook = write_workbook(program, size, args.data_dir)
+        if args.generate_only:
+            print("Wrote " + workbook)
+            continue
+        chart_dir = None
+        if not args.no_charts:
+            chart_dir = os.path.join(args.data_dir, "charts-%d" % size)
+        results['sizes'][str(size)] = \
+        benchmark_workbook(program, workbook, args.calls, chart_dir)
+    if args.generate_only:
+        return 0
+    print_results(results)
+    if not os.path.isdir(args.results_dir):
+        os.makedirs(args.results_dir)
+    path = os.path.join(args.results_dir, "results-%s.json" % \
+                        time.strftime('%Y%m%d-%H%M%S'))
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent = 1)
+    print("Saved the results to " + path)
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            regressions = compare_results(results, json.load(baseline_file), \
+                                          args.threshold)
+        for regression in regressions:
+            print("Regression: " + regression)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
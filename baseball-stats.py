@@ -4,21 +4,1896 @@
 #              I consulted source #1 (see ReadMe for details)for general help
 #              on this program.
 
+import argparse
+import ast
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+import unicodedata
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+
+STATS = ['G', 'AB', 'R', 'H', '2B', '3B', 'HR', 'RBI', 'BB', 'K', 'SB', \
+         'CS', 'AVG', 'SLG', 'OBP', 'OPS']
+COUNTING_STATS = STATS[:12]
+GAME_LOG_STATS = COUNTING_STATS + ['HBP', 'SF']
+TEAM_ABBREVIATIONS = {"arizona diamondbacks": "AZ",
+                      "atlanta braves": "ATL",
+                      "baltimore orioles": "BAL",
+                      "boston red sox": "BOS",
+                      "chicago cubs": "CHC",
+                      "chicago white sox": "CHW",
+                      "cincinnati reds": "CIN",
+                      "cleveland indians": "CLE",
+                      "colorado rockies": "COL",
+                      "detroit tigers": "DET",
+                      "miami marlins": "MIA",
+                      "houston astros": "HOU",
+                      "kansas city royals": "KC",
+                      "los angeles angels": "LAA",
+                      "los angeles dodgers": "LAD",
+                      "milwaukee brewers": "MIL",
+                      "minnesota twins": "MIN",
+                      "new york yankees": "NYY",
+                      "new york mets": "NYM",
+                      "oakland athletics": "OAK",
+                      "philadelphia phillies": "PHI",
+                      "pittsburgh pirates": "PIT",
+                      "san diego padres": "SD",
+                      "san francisco giants": "SF",
+                      "seattle mariners": "SEA",
+                      "st. louis cardinals": "STL",
+                      "tampa bay rays": "TB",
+                      "texas rangers": "TEX",
+                      "toronto blue jays": "TOR",
+                      "washington nationals": "WSH"}
+TEAM_NAMES = dict((abbrev, name.title()) for name, abbrev in \
+                  TEAM_ABBREVIATIONS.items())
+DIVISIONS = {'AL East': ['BAL', 'BOS', 'NYY', 'TB', 'TOR'],
+             'AL Central': ['CHW', 'CLE', 'DET', 'KC', 'MIN'],
+             'AL West': ['HOU', 'LAA', 'OAK', 'SEA', 'TEX'],
+             'NL East': ['ATL', 'MIA', 'NYM', 'PHI', 'WSH'],
+             'NL Central': ['CHC', 'CIN', 'MIL', 'PIT', 'STL'],
+             'NL West': ['AZ', 'COL', 'LAD', 'SD', 'SF']}
+WILD_CARDS = 2
+# The memory (in bytes) a similarity search's distance blocks can use.
+SIMILARITY_MEMORY = 2 ** 27
+# The number of players a similarity search looks for at a time, and the
+# number of candidates on each side of them (along the principal axis) it
+# searches first.
+SIMILARITY_BLOCK = 16
+SIMILARITY_WINDOW = 2048
+# The memory (in bytes) a batch of bootstrap resamples can use.
+BOOTSTRAP_MEMORY = 2 ** 26
+# The number of wall times kept (as a uniform sample) for each measured call
+# name's p50/p95 latencies.
+INSTRUMENTATION_SAMPLES = 4096
+# The number of distinct command results a batch keeps for reuse.
+BATCH_MEMO_SIZE = 4096
+# The commands whose last argument is a random seed: with a seed of 'random'
+# every run differs, so their results aren't reused.
+SEEDED_COMMANDS = ('get-playoff-odds', 'get-stat-interval', \
+                   'get-team-stat-intervals')
+# The derived stats, in evaluation order (a stat can use the ones before it).
+# Stats that aren't identifiers are quoted with backticks, and league(x) is
+# the league's value of x, weighted by plate appearances (AB + BB). The
+# Batters sheet has no HBP, SF or IBB, so plate appearances are AB + BB, and
+# BABIP and wOBA leave them out. The wOBA weights are the 2016 weights.
+DERIVED_STATS = collections.OrderedDict([
+    ('ISO', "SLG - AVG"),
+    ('BABIP', "(H - HR) / (AB - K - HR)"),
+    ('BB%', "100 * BB / (AB + BB)"),
+    ('K%', "100 * K / (AB + BB)"),
+    ('SB%', "100 * SB / (SB + CS)"),
+    ('wOBA', "(0.691 * BB + 0.878 * (H - `2B` - `3B` - HR) + " + \
+             "1.242 * `2B` + 1.569 * `3B` + 2.015 * HR) / (AB + BB)"),
+    ('OPS+', "100 * (OBP / league(OBP) + SLG / league(SLG) - 1)"),
+    ('ISO+', "100 * ISO / league(ISO)"),
+    ('wOBA+', "100 * wOBA / league(wOBA)")])
+
+# The columnar cache's format version; caches written in another format are
+# rebuilt.
+CACHE_VERSION = 2
+
+class ColumnarCache(object):
+
+    # Purpose: Initializes the cache for one sheet of an Excel workbook. The
+    #          cache is a directory of .npy files (one per column, one per
+    #          text column with missing values holding their mask, plus one
+    #          for the index) next to the workbook, and a meta.json file
+    #          holding the column order and the workbook's size, mtime and
+    #          hash.
+    # Arguments: A string: the path to the workbook. A string: the sheet name.
+    #            A string: the cache directory (defaults to
+    #            '.<workbook>.<sheet>.cache' next to the workbook).
+    # Returns: Nothing.
+    def __init__(self, workbook, sheet, cache_dir = None):
+        self.__workbook = workbook
+        self.__sheet = sheet
+        if cache_dir is None:
+            head, tail = os.path.split(os.path.abspath(workbook))
+            cache_dir = os.path.join(head, "." + tail + "." + sheet + \
+                                     ".cache")
+        self.__cache_dir = cache_dir
+        self.__meta_file = os.path.join(cache_dir, 'meta.json')
+
+    # Purpose: Hashes the workbook's contents.
+    # Arguments: None.
+    # Returns: A string: the workbook's SHA-256 hex digest.
+    def __hash_workbook(self):
+        digest = hashlib.sha256()
+        with open(self.__workbook, 'rb') as workbook:
+            for block in iter(lambda: workbook.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    # Purpose: Reads the cache's meta data.
+    # Arguments: None.
+    # Returns: A dictionary: the meta data, or None if there is no cache.
+    def __read_meta(self):
+        try:
+            with open(self.__meta_file) as meta_file:
+                return json.load(meta_file)
+        except (IOError, ValueError):
+            return None
+
+    # Purpose: Checks if the cache matches the current workbook. If the size
+    #          and mtime match, the cache is fresh. If only the mtime changed,
+    #          the workbook is hashed, and the cache is still fresh when the
+    #          hash matches (the new mtime is then recorded).
+    # Arguments: None.
+    # Returns: A boolean: True if the cache can be loaded.
+    def is_fresh(self):
+        meta = self.__read_meta()
+        if meta is None or meta.get('version') != CACHE_VERSION:
+            return False
+        workbook_stat = os.stat(self.__workbook)
+        if meta['size'] != workbook_stat.st_size:
+            return False
+        if meta['mtime'] == workbook_stat.st_mtime_ns:
+            return True
+        if meta['hash'] != self.__hash_workbook():
+            return False
+        meta['mtime'] = workbook_stat.st_mtime_ns
+        with open(self.__meta_file, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        return True
+
+    # Purpose: Loads the cached frame. The numeric columns are memory-mapped,
+    #          and only the requested columns are read. Missing text values
+    #          are restored as NaN, as the workbook has them.
+    # Arguments: A list of strings: the columns (None loads every column).
+    # Returns: A DataFrame: the cached frame, or None if a cache file is
+    #          missing or damaged (the cache must then be rebuilt). Raises a
+    #          KeyError if a column is not in the cache.
+    def load(self, columns = None):
+        meta = self.__read_meta()
+        if columns is None:
+            columns = meta['columns']
+        for column in columns:
+            if column not in meta['columns']:
+                raise KeyError(column)
+        arrays = {}
+        try:
+            for column in columns:
+                i = meta['columns'].index(column)
+                values = np.load(os.path.join(self.__cache_dir, \
+                                              "%d.npy" % i), mmap_mode = 'r')
+                if i in meta['nulls']:
+                    nulls = np.load(os.path.join(self.__cache_dir, \
+                                                 "%d.null.npy" % i))
+                    values = values.astype(object)
+                    values[nulls] = np.nan
+                arrays[column] = values
+            index = np.load(os.path.join(self.__cache_dir, 'index.npy'))
+        except (IOError, ValueError, EOFError, IndexError):
+            return None
+        if any(len(values) != len(index) for values in arrays.values()):
+            return None
+        frame = pd.DataFrame(arrays, index = pd.Index(index, \
+                                                      name = meta['index']))
+        return frame[list(columns)]
+
+    # Purpose: Writes a frame to the cache. The meta data is written last, so
+    #          a partially written cache is never loaded.
+    # Arguments: A DataFrame: the frame to be cached.
+    # Returns: Nothing.
+    def save(self, frame):
+        if os.path.isdir(self.__cache_dir):
+            shutil.rmtree(self.__cache_dir)
+        os.makedirs(self.__cache_dir)
+        nulls = []
+        for i, column in enumerate(frame.columns):
+            values = frame[column].to_numpy()
+            if values.dtype == object or not \
+               np.issubdtype(values.dtype, np.number):
+                missing = pd.isna(values)
+                if missing.any():
+                    nulls.append(i)
+                    np.save(os.path.join(self.__cache_dir, \
+                                         "%d.null.npy" % i), missing)
+                    values = np.where(missing, '', values)
+                values = values.astype('U')
+            np.save(os.path.join(self.__cache_dir, "%d.npy" % i), values)
+        np.save(os.path.join(self.__cache_dir, 'index.npy'), \
+                frame.index.to_numpy().astype('U'))
+        workbook_stat = os.stat(self.__workbook)
+        meta = {'version': CACHE_VERSION,
+                'columns': [str(column) for column in frame.columns],
+                'nulls': nulls,
+                'index': frame.index.name,
+                'size': workbook_stat.st_size,
+                'mtime': workbook_stat.st_mtime_ns,
+                'hash': self.__hash_workbook()}
+        with open(self.__meta_file, 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+# Purpose: Parses the Batters sheet of a workbook into a DataFrame indexed by
+#          the title-cased player names.
+# Arguments: A string: the path to the workbook. A string: the sheet name.
+# Returns: A DataFrame: the batters' stats.
+def parse_batter_stats(workbook, sheet = 'Batters'):
+    batter_stats = pd.ExcelFile(workbook).parse(sheet)
+    batter_stats.index = batter_stats['PLAYER']
+    batter_stats = batter_stats.drop('PLAYER', axis = 1)
+    batter_stats.index = batter_stats.index.map(str.title)
+    return batter_stats
+
+# Purpose: Loads the batters' stats from the columnar cache, parsing the
+#          workbook (and rebuilding the cache) only if the cache is
+#          missing, damaged or out of date.
+# Arguments: A string: the path to the workbook. A string: the sheet name.
+#            A boolean: whether to use the cache. A list of strings: the
+#            columns to load (None loads every column).
+# Returns: A tuple: the DataFrame, where it was loaded from ('cache' or
+#          'excel') and the load time in seconds.
+def load_batter_stats(workbook, sheet = 'Batters', use_cache = True, \
+                      columns = None):
+    start = time.perf_counter()
+    cache = ColumnarCache(workbook, sheet)
+    batter_stats = None
+    if use_cache and cache.is_fresh():
+        batter_stats = cache.load(columns)
+        source = 'cache'
+    if batter_stats is None:
+        batter_stats = parse_batter_stats(workbook, sheet)
+        if use_cache:
+            cache.save(batter_stats)
+        if columns is not None:
+            batter_stats = batter_stats[list(columns)]
+        source = 'excel'
+    return batter_stats, source, time.perf_counter() - start
+
+# Purpose: Gets the season in a workbook's file name (e.g. 2016 for
+#          'mlb-stats2016.xlsx'). Only a year from 1900 to 2099 that isn't
+#          part of a longer number counts (so 'batters-1000.xlsx' has none).
+# Arguments: A string: the workbook's path.
+# Returns: An int: the season, or None if the name has no year in it.
+def season_from_name(workbook):
+    match = re.search(r'(?<!\d)((?:19|20)\d\d)(?!\d)', \
+                      os.path.basename(workbook))
+    return int(match.group(1)) if match else None
+
+class SeasonStore(object):
+
+    # Purpose: Initializes the store of season workbooks. The source is a
+    #          workbook (one season), a directory of workbooks named after
+    #          their season (e.g. 'mlb-stats2015.xlsx'), or a JSON manifest
+    #          mapping each season to a workbook path or to {"workbook": ...,
+    #          "sheet": ...}. Nothing is loaded until a season is used.
+    # Arguments: A string: the source. A boolean: whether to use the
+    #            columnar cache. A boolean: whether seasons use the compact
+    #            layout. An int: the most seasons kept loaded at once.
+    # Returns: Nothing.
+    def __init__(self, source, use_cache = True, compact = False, \
+                 max_resident = 3):
+        self.__use_cache = use_cache
+        self.__compact = compact
+        self.__max_resident = max_resident
+        self.__workbooks = {}
+        self.__resident = collections.OrderedDict()
+        self.__name_keys = {}
+        if os.path.isdir(source):
+            for name in sorted(os.listdir(source)):
+                season = season_from_name(name)
+                if name.endswith('.xlsx') and not name.startswith('~') and \
+                   season is not None:
+                    self.__workbooks[season] = (os.path.join(source, name), \
+                                                'Batters')
+        elif source.endswith('.json'):
+            with open(source) as manifest_file:
+                manifest = json.load(manifest_file)
+            base = os.path.dirname(os.path.abspath(source))
+            for season, entry in manifest.items():
+                if not isinstance(entry, dict):
+                    entry = {'workbook': entry}
+                self.__workbooks[int(season)] = \
+                (os.path.join(base, entry['workbook']), \
+                 entry.get('sheet', 'Batters'))
+        else:
+            self.__workbooks[season_from_name(source)] = (source, 'Batters')
+        if not self.__workbooks:
+            raise ValueError("No season workbooks in " + source)
+
+    # Purpose: Gets the seasons in the store.
+    # Arguments: None.
+    # Returns: A list: the seasons, sorted.
+    def get_seasons(self):
+        return sorted(self.__workbooks, key = lambda season: (season is None, \
+                                                               season))
+
+    # Purpose: Gets a season's workbook.
+    # Arguments: An int: the season.
+    # Returns: A tuple: the workbook's path and sheet name.
+    def get_workbook(self, season):
+        if season not in self.__workbooks:
+            raise KeyError("No workbook for season %s" % (season,))
+        return self.__workbooks[season]
+
+    # Purpose: Keeps a loaded season resident, evicting the least recently
+    #          used season if too many are loaded.
+    # Arguments: An int: the season. A BaseballAnalytics: the season's data.
+    # Returns: Nothing.
+    def add_resident(self, season, ba):
+        self.__resident[season] = ba
+        self.__resident.move_to_end(season)
+        while len(self.__resident) > self.__max_resident:
+            self.__resident.popitem(last = False)
+
+    # Purpose: Gets a season's BaseballAnalytics object if using it costs no
+    #          more than reading some of its columns: if it is resident, or
+    #          if the store doesn't use the columnar cache (every read would
+    #          then parse the whole workbook, so the season is loaded once
+    #          and kept resident instead).
+    # Arguments: An int: the season.
+    # Returns: A BaseballAnalytics: the season's data (None if the season
+    #          is better read by column).
+    def get_loaded(self, season):
+        if season in self.__resident or not self.__use_cache:
+            return self.get_season(season)
+        return None
+
+    # Purpose: Gets a season's BaseballAnalytics object, loading the season
+    #          if it is not resident.
+    # Arguments: An int: the season.
+    # Returns: A BaseballAnalytics: the season's data.
+    def get_season(self, season):
+        if season in self.__resident:
+            self.__resident.move_to_end(season)
+            return self.__resident[season]
+        workbook, sheet = self.get_workbook(season)
+        ba = BaseballAnalytics(workbook, self.__use_cache, self.__compact, \
+                               sheet, season, self)
+        self.add_resident(season, ba)
+        return ba
+
+    # Purpose: Loads some columns of a season without loading the season
+    #          (through the columnar cache, only those columns are read).
+    # Arguments: An int: the season. A list of strings: the columns.
+    # Returns: A DataFrame: the columns, indexed by player name.
+    def get_columns(self, season, columns):
+        workbook, sheet = self.get_workbook(season)
+        return load_batter_stats(workbook, sheet, self.__use_cache, \
+                                 columns)[0]
+
+    # Purpose: Gets the rows of a season's players with a name. The season's
+    #          normalized names are computed once and kept.
+    # Arguments: An int: the season. A string: the name ("Last, First").
+    # Returns: A list of ints: the row positions.
+    def get_player_rows(self, season, name):
+        if season not in self.__name_keys:
+            keys = {}
+            workbook, sheet = self.get_workbook(season)
+            names = load_batter_stats(workbook, sheet, self.__use_cache, \
+                                      [])[0].index
+            for position, player in enumerate(names):
+                keys.setdefault(normalize_name(player), []).append(position)
+            self.__name_keys[season] = keys
+        return self.__name_keys[season].get(normalize_name(name), [])
+
+# Purpose: Computes a batting line from counting stats: AVG = H/AB, SLG =
+#          total bases/AB and OPS = OBP + SLG. OBP needs hit-by-pitches and
+#          sacrifice flies, which the sheets don't have, so it is the
+#          seasons' OBPs weighted by AB + BB.
+# Arguments: A DataFrame: one row per season with the counting stats and
+#            OBP.
+# Returns: A Series: the combined line, with every stat.
+def combine_batting_lines(seasons):
+    line = seasons[COUNTING_STATS].sum().astype(np.int64)
+    at_bats = float(line['AB'])
+    total_bases = line['H'] + line['2B'] + 2 * line['3B'] + 3 * line['HR']
+    weights = (seasons['AB'] + seasons['BB']).astype(np.float64)
+    line = line.astype(object)
+    line['AVG'] = line['H'] / at_bats if at_bats else 0.0
+    line['SLG'] = total_bases / at_bats if at_bats else 0.0
+    line['OBP'] = float((seasons['OBP'] * weights).sum() / weights.sum()) if \
+                  weights.sum() else 0.0
+    line['OPS'] = line['OBP'] + line['SLG']
+    return line
+
+# Purpose: Reads a game log in chunks. Each line is one player's batting
+#          line in one game: PLAYER ("Last, First"), Team, POS and any of the
+#          counting stats (G defaults to 1 and the others to 0), plus the
+#          hit-by-pitches (HBP) and sacrifice flies (SF) if they are known.
+# Arguments: A string: the path to a CSV file or a JSON lines file ('.jsonl'
+#            or '.json'). An int: the number of lines per chunk.
+# Returns: A generator of DataFrames: the chunks.
+def read_game_logs(path, chunk_size = 10000):
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        reader = pd.read_json(path, lines = True, chunksize = chunk_size, \
+                              dtype = {'PLAYER': str, 'Team': str, \
+                                       'POS': str})
+    else:
+        reader = pd.read_csv(path, chunksize = chunk_size, \
+                             dtype = {'PLAYER': str, 'Team': str, \
+                                      'POS': str})
+    with reader:
+        for chunk in reader:
+            yield chunk
+
+# The syntax allowed in a derived stat's expression.
+EXPRESSION_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Add, \
+                    ast.Sub, ast.Mult, ast.Div, ast.USub, ast.UAdd, \
+                    ast.Name, ast.Load, ast.Constant, ast.Call)
+
+class DerivedStats(object):
+
+    # Purpose: Initializes the derived stats. Each stat is an arithmetic
+    #          expression of other stats (+, -, *, / and numbers), parsed
+    #          once and checked here, so a bad definition fails when it is
+    #          added rather than when it is used.
+    # Arguments: A dictionary: each derived stat's name with its expression
+    #            (see DERIVED_STATS). A list of strings: the base stats.
+    # Returns: Nothing.
+    def __init__(self, definitions, base_stats = STATS):
+        self.__base_stats = list(base_stats)
+        self.__expressions = collections.OrderedDict()
+        for name, expression in definitions.items():
+            self.add(name, expression)
+
+    # Purpose: Gets the derived stats' names.
+    # Arguments: None.
+    # Returns: A list of strings: the names, in evaluation order.
+    def get_names(self):
+        return list(self.__expressions)
+
+    # Purpose: Gets a derived stat's expression.
+    # Arguments: A string: the derived stat.
+    # Returns: A string: the expression.
+    def get_expression(self, name):
+        return self.__expressions[name][0]
+
+    # Purpose: Adds (or redefines) a derived stat.
+    # Arguments: A string: the name. A string: the expression, which can use
+    #            the base stats and the derived stats already defined.
+    # Returns: Nothing.
+    def add(self, name, expression):
+        if name in self.__base_stats:
+            raise ValueError("%s is a base stat" % (name,))
+        # A redefined stat keeps its place, so it can only use the stats
+        # before it.
+        names = list(self.__expressions)
+        if name in names:
+            names = names[:names.index(name)]
+        known = self.__base_stats + names
+        quoted = {}
+        used = set()
+        def quote(match):
+            quoted['_stat%d' % len(quoted)] = match.group(1)
+            return '_stat%d' % (len(quoted) - 1)
+        try:
+            tree = ast.parse(re.sub(r'`([^`]+)`', quote, expression), \
+                             mode = 'eval')
+        except SyntaxError:
+            raise ValueError("Invalid expression: %s" % (expression,))
+        functions = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, EXPRESSION_NODES) or \
+               (isinstance(node, ast.Constant) and \
+                type(node.value) not in (int, float)):
+                raise ValueError("Invalid expression: %s" % (expression,))
+            if isinstance(node, ast.Call):
+                if not isinstance(node.func, ast.Name) or \
+                   node.func.id != 'league' or len(node.args) != 1 or \
+                   node.keywords:
+                    raise ValueError("Invalid expression: %s" % \
+                                     (expression,))
+                functions.add(id(node.func))
+            elif isinstance(node, ast.Name) and id(node) not in functions:
+                stat = quoted.get(node.id, node.id)
+                if stat not in known:
+                    raise ValueError("Unknown stat in %s: %s" % (name, stat))
+                used.add(stat)
+        self.__expressions[name] = (expression, tree.body, quoted, used)
+
+    # Purpose: Removes a derived stat.
+    # Arguments: A string: the derived stat.
+    # Returns: Nothing.
+    def remove(self, name):
+        users = [stat for stat, definition in self.__expressions.items() if \
+                 name in definition[3]]
+        if users:
+            raise ValueError("%s is used by %s" % (name, ', '.join(users)))
+        del self.__expressions[name]
+
+    # Purpose: Evaluates a parsed expression over whole columns.
+    # Arguments: An ast node: the expression. A dictionary: the quoted stats'
+    #            placeholders with their names. A dictionary: each stat with
+    #            its values. A numpy array: the plate appearances (the
+    #            league weights).
+    # Returns: A numpy array or float: the values.
+    def __evaluate(self, node, quoted, columns, weights):
+        if isinstance(node, ast.Constant):
+            return float(node.value)
+        if isinstance(node, ast.Name):
+            return columns[quoted.get(node.id, node.id)]
+        if isinstance(node, ast.UnaryOp):
+            operand = self.__evaluate(node.operand, quoted, columns, weights)
+            return -operand if isinstance(node.op, ast.USub) else operand
+        if isinstance(node, ast.Call):
+            values = self.__evaluate(node.args[0], quoted, columns, weights)
+            values = np.broadcast_to(values, weights.shape)
+            total = weights.sum()
+            return float((values * weights).sum() / total) if total else 0.0
+        left = self.__evaluate(node.left, quoted, columns, weights)
+        right = self.__evaluate(node.right, quoted, columns, weights)
+        if isinstance(node.op, ast.Add):
+            return left + right
+        if isinstance(node.op, ast.Sub):
+            return left - right
+        if isinstance(node.op, ast.Mult):
+            return left * right
+        return left / right
+
+    # Purpose: Computes every derived stat in one vectorized pass over the
+    #          batters' stats. Where a denominator is zero the stat is 0 (as
+    #          AVG is for a player with no at bats).
+    # Arguments: A DataFrame: the batters' stats.
+    # Returns: A DataFrame: the derived stats (float64), with the same index.
+    def compute(self, frame):
+        columns = dict((stat, frame[stat].to_numpy(dtype = np.float64)) for \
+                       stat in self.__base_stats)
+        weights = columns['AB'] + columns['BB']
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            for name, (expression, node, quoted, used) in \
+                self.__expressions.items():
+                values = np.broadcast_to(self.__evaluate(node, quoted, \
+                                         columns, weights), \
+                                         weights.shape).astype(np.float64)
+                values[~np.isfinite(values)] = 0.0
+                columns[name] = values
+        return pd.DataFrame(dict((name, columns[name]) for name in \
+                                 self.__expressions), index = frame.index)
+
+class StatOrderIndex(object):
+
+    # Purpose: Initializes the index. For each stat, the row positions are
+    #          sorted (stably) by the stat's score, so threshold, range and
+    #          top-k queries become binary searches and slices. For each
+    #          group column (e.g. 'Team'), the rows are also sorted by group
+    #          and then by score, so the same queries can be restricted to
+    #          one group. A stat's orders are stored one after another in one
+    #          array, so they can be updated together. In the compact layout,
+    #          the orders are int32s and the sorted scores aren't kept (they
+    #          are read from the frame through the order when needed).
+    # Arguments: A DataFrame: the batters' stats. A list of strings: the
+    #            stats. A tuple of strings: the group columns. A boolean:
+    #            whether to use the compact layout.
+    # Returns: Nothing.
+    def __init__(self, frame, stats, group_columns = ('Team', 'POS'), \
+                 compact = False):
+        self.__frame = frame
+        self.__stats = stats
+        self.__num_rows = len(frame)
+        self.__order_dtype = np.int32 if compact and \
+                             3 * len(frame) < 2 ** 31 else np.intp
+        self.__sorted = {}
+        self.__bases = {None: 0}
+        self.__group_offsets = {}
+        # Each ordering's group codes and group offsets (the ungrouped order
+        # is one group).
+        self.__layouts = [(np.zeros(len(frame), dtype = np.intp), \
+                           np.array([0, len(frame)]))]
+        for column in group_columns:
+            codes, groups = pd.factorize(frame[column], sort = True)
+            bounds = np.searchsorted(np.sort(codes), \
+                                     np.arange(len(groups) + 1))
+            self.__group_offsets[column] = \
+            dict((group, (bounds[i], bounds[i + 1])) for i, group in \
+                 enumerate(groups))
+            self.__bases[column] = len(self.__layouts) * len(frame)
+            self.__layouts.append((codes, bounds))
+        for stat in stats:
+            values = frame[stat].to_numpy()
+            orders = [np.argsort(values, kind = 'mergesort')]
+            for codes, bounds in self.__layouts[1:]:
+                orders.append(np.lexsort((values, codes)))
+            order = np.concatenate(orders).astype(self.__order_dtype)
+            self.__sorted[stat] = (order, None if compact else values[order])
+
+    # Purpose: Gets the memory used by the index.
+    # Arguments: None.
+    # Returns: An int: the bytes used by the orders, the sorted scores and
+    #          the group codes.
+    def get_memory_usage(self):
+        usage = sum(codes.nbytes + bounds.nbytes for codes, bounds in \
+                    self.__layouts)
+        for order, values in self.__sorted.values():
+            usage += order.nbytes + (0 if values is None else values.nbytes)
+        return usage
+
+    # Purpose: Gets a stat's scores in some sorted positions, from the kept
+    #          sorted scores or (in the compact layout) from the frame.
+    # Arguments: A string: the stat. A slice or numpy array: the positions
+    #            in the stat's orders.
+    # Returns: A numpy array: the scores.
+    def __get_values(self, stat, positions):
+        order, values = self.__sorted[stat]
+        if values is None:
+            return self.__frame[stat].to_numpy()[order[positions]]
+        return values[positions]
+
+    # Purpose: Gets the sorted row positions and scores for a stat, restricted
+    #          to one group if a group column and value are given.
+    # Arguments: A string: the stat. A string: the group column. A string:
+    #            the group value.
+    # Returns: A tuple: the row positions and the sorted scores.
+    def __get_sorted(self, stat, column = None, value = None):
+        if column is None:
+            start, end = 0, self.__num_rows
+        else:
+            start, end = self.__group_offsets[column].get(value, (0, 0))
+            start += self.__bases[column]
+            end += self.__bases[column]
+        return self.__sorted[stat][0][start:end], \
+               self.__get_values(stat, slice(start, end))
+
+    # Purpose: Finds where scores belong in sorted row positions and scores,
+    #          each within its own slice of the arrays. Ties are ordered by row
+    #          position. All of the binary searches run together.
+    # Arguments: A numpy array: the sorted row positions. A numpy array: the
+    #            sorted scores. Two numpy arrays: each search's slice (start
+    #            and end). A numpy array: the rows. A numpy array: the rows'
+    #            scores.
+    # Returns: A numpy array: the index where each row belongs.
+    def __search(self, order, values, starts, ends, positions, new_values):
+        low = starts.copy()
+        high = ends.copy()
+        searching = low < high
+        while searching.any():
+            middle = (low + high) // 2
+            probe = np.minimum(middle, len(order) - 1)
+            below = (values[probe] < new_values) | \
+                    ((values[probe] == new_values) & \
+                     (order[probe] < positions))
+            low = np.where(searching & below, middle + 1, low)
+            high = np.where(searching & ~below, middle, high)
+            searching = low < high
+        return low
+
+    # Purpose: Moves some rows to their new places in a stat's orders, as if
+    #          the scores had been stably sorted again.
+    # Arguments: A numpy array: the sorted row positions. A numpy array: the
+    #            sorted scores. A numpy array of booleans: which rows changed.
+    #            A numpy array: the rows that changed (once per ordering). A
+    #            numpy array: the rows' new scores. Two numpy arrays: the
+    #            slice (start and end) each row belongs in. A numpy array:
+    #            the stat's column (its unchanged rows give the kept scores
+    #            when the sorted scores aren't kept).
+    # Returns: A tuple: the new sorted row positions and scores (None if
+    #          they aren't kept).
+    def __reinsert(self, order, values, changed, positions, new_values, \
+                   starts, ends, column):
+        kept = ~changed[order]
+        kept_before = np.concatenate(([0], np.cumsum(kept)))
+        order = order[kept]
+        if values is None:
+            kept_values = column[order]
+        else:
+            kept_values = values[kept].astype(np.result_type(values, \
+                                                             new_values), \
+                                              copy = False)
+        slots = self.__search(order, kept_values, kept_before[starts], \
+                              kept_before[ends], positions, new_values)
+        moved = np.lexsort((positions, new_values, starts, slots))
+        order = np.insert(order, slots[moved], positions[moved])
+        if values is None:
+            return order, None
+        return order, np.insert(kept_values, slots[moved], \
+                                new_values[moved])
+
+    # Purpose: Updates the index after some rows' scores changed (their
+    #          groups must not change). Only the changed rows are moved.
+    # Arguments: A DataFrame: the batters' stats, with the new scores. A numpy
+    #            array: the row positions that changed.
+    # Returns: Nothing.
+    def update(self, frame, positions):
+        self.__frame = frame
+        changed = np.zeros(self.__num_rows, dtype = bool)
+        changed[positions] = True
+        starts = []
+        ends = []
+        for i, (codes, bounds) in enumerate(self.__layouts):
+            groups = codes[positions]
+            starts.append(i * self.__num_rows + bounds[groups])
+            ends.append(i * self.__num_rows + bounds[groups + 1])
+        starts = np.concatenate(starts)
+        ends = np.concatenate(ends)
+        rows = np.tile(positions, len(self.__layouts))
+        for stat in self.__stats:
+            column = frame[stat].to_numpy()
+            new_values = column[positions]
+            order, values = self.__sorted[stat]
+            self.__sorted[stat] = \
+            self.__reinsert(order, values, changed, rows, \
+                            np.tile(new_values, len(self.__layouts)), \
+                            starts, ends, column)
+
+    # Purpose: Gets the median score of a stat in some groups.
+    # Arguments: A string: the group column. A string: the stat. A list of
+    #            strings: the groups.
+    # Returns: A numpy array of floats: each group's median.
+    def get_medians(self, column, stat, groups):
+        offsets = self.__group_offsets[column]
+        starts = self.__bases[column] + \
+                 np.array([offsets[group][0] for group in groups])
+        ends = self.__bases[column] + \
+               np.array([offsets[group][1] for group in groups])
+        lower = self.__get_values(stat, (starts + ends - 1) // 2)\
+                .astype(np.float64)
+        upper = self.__get_values(stat, (starts + ends) // 2)\
+                .astype(np.float64)
+        return (lower + upper) / 2
+
+    # Purpose: Gets each row's rank in a stat, where tied scores share the
+    #          lowest rank (like pandas' rank(method = 'min')).
+    # Arguments: A string: the stat.
+    # Returns: A numpy array of floats: the ranks, in row order.
+    def get_min_ranks(self, stat):
+        order, values = self.__get_sorted(stat)
+        ranks = np.empty(len(order))
+        ranks[order] = np.searchsorted(values, values, 'left') + 1
+        return ranks
+
+    # Purpose: Computes a quantile of the sorted scores the same way pandas
+    #          does (linear interpolation), without re-scanning the column.
+    # Arguments: A numpy array: the sorted scores. A float: the quantile.
+    # Returns: A float: the score at the quantile.
+    def __sorted_quantile(self, values, quantile):
+        position = quantile * (len(values) - 1)
+        below = int(np.floor(position))
+        above = min(below + 1, len(values) - 1)
+        return np.quantile(values[below:above + 1], position - below)
+
+    # Purpose: Gets the players at or above the specified quantile of a stat.
+    # Arguments: A string: the stat. A float: the quantile.
+    # Returns: A numpy array: the row positions, sorted by ascending score.
+    def at_or_above(self, stat, quantile):
+        order, values = self.__get_sorted(stat)
+        threshold = self.__sorted_quantile(values, quantile)
+        return order[np.searchsorted(values, threshold, 'left'):]
+
+    # Purpose: Gets the players whose score in a stat is in [low, high].
+    # Arguments: A string: the stat. Two floats: the bounds (inclusive).
+    #            Two strings: the optional group column and value.
+    # Returns: A numpy array: the row positions, sorted by ascending score.
+    def between(self, stat, low, high, column = None, value = None):
+        order, values = self.__get_sorted(stat, column, value)
+        return order[np.searchsorted(values, low, 'left'): \
+                     np.searchsorted(values, high, 'right')]
+
+    # Purpose: Gets the k players with the highest scores in a stat. Players
+    #          tied with the k-th score are all included, so k = 1 gives
+    #          every player tied for the max.
+    # Arguments: A string: the stat. An int: k. Two strings: the optional
+    #            group column and value.
+    # Returns: A numpy array: the row positions, sorted by descending score
+    #          (tied players stay in their original order).
+    def top_k(self, stat, k, column = None, value = None):
+        order, values = self.__get_sorted(stat, column, value)
+        if k <= 0 or len(values) == 0:
+            return order[:0]
+        start = np.searchsorted(values, values[max(len(values) - k, 0)], \
+                                'left')
+        top = np.argsort(-values[start:], kind = 'mergesort')
+        return order[start:][top]
+
+class TeamIndex(object):
+
+    # Purpose: Initializes the team partition index. The rows are stably
+    #          sorted by a categorical Team column, so each team's players are
+    #          one contiguous slice of the sorted row positions.
+    # Arguments: A DataFrame: the batters' stats. A list of strings: the
+    #            stats to aggregate. A StatOrderIndex: the stats' order
+    #            index, grouped by team (the team medians are read from it).
+    # Returns: Nothing.
+    def __init__(self, frame, stats, stat_order):
+        self.__frame = frame
+        self.__stats = stats
+        self.__stat_order = stat_order
+        teams = pd.Categorical(frame['Team'])
+        self.__codes = teams.codes
+        self.__order = np.argsort(teams.codes, kind = 'mergesort')
+        bounds = np.searchsorted(teams.codes[self.__order], \
+                                 np.arange(len(teams.categories) + 1))
+        self.__teams = list(teams.categories)
+        self.__offsets = dict((team, (bounds[i], bounds[i + 1])) for i, team \
+                              in enumerate(self.__teams))
+        self.__counts = np.diff(bounds)
+        # The integer stats' columns, and the other stats' columns.
+        self.__integer = np.array([i for i, stat in enumerate(stats) if \
+                                   np.issubdtype(frame[stat].dtype, \
+                                                 np.integer)], dtype = np.intp)
+        self.__floating = np.array([i for i in range(len(stats)) if i not in \
+                                    self.__integer], dtype = np.intp)
+        self.__sums = None
+        self.__squares = None
+        self.__integer_sums = None
+        self.__integer_squares = None
+        self.__aggregates = None
+        # Guards the memoized sums and aggregates, which the query server's
+        # threads can request at once.
+        self.__lock = threading.Lock()
+
+    # Purpose: Gets the teams in the index.
+    # Arguments: None.
+    # Returns: A list of strings: the teams' abbreviations, sorted.
+    def get_teams(self):
+        return self.__teams
+
+    # Purpose: Gets the memory used by the index.
+    # Arguments: None.
+    # Returns: An int: the bytes used by the team codes and order, the
+    #          accumulated sums and the memoized aggregates.
+    def get_memory_usage(self):
+        usage = self.__codes.nbytes + self.__order.nbytes + \
+                self.__counts.nbytes
+        for sums in (self.__sums, self.__squares, self.__integer_sums, \
+                     self.__integer_squares):
+            usage += 0 if sums is None else sums.nbytes
+        aggregates = self.__aggregates
+        if aggregates is not None:
+            usage += sum(int(frame.memory_usage(deep = True).sum()) for \
+                         frame in aggregates.values())
+        return usage
+
+    # Purpose: Gets the row positions of a team's players.
+    # Arguments: A string: the team's abbreviation.
+    # Returns: A numpy array: the row positions, in their original order.
+    def get_rows(self, team_abbrev):
+        start, end = self.__offsets.get(team_abbrev, (0, 0))
+        return self.__order[start:end]
+
+    # Purpose: Computes every team's sum of every stat in one pass over the
+    #          team-sorted stats matrix. The integer stats' sums and sums of
+    #          squares are kept as exact int64s; for the other stats, the
+    #          sum of the squared differences from the team's mean is kept.
+    # Arguments: None.
+    # Returns: Nothing.
+    def __accumulate(self):
+        starts = np.concatenate(([0], np.cumsum(self.__counts)[:-1]))
+        stats = [self.__stats[i] for i in self.__integer]
+        matrix = self.__frame[stats].to_numpy(dtype = np.int64)
+        matrix = matrix[self.__order]
+        self.__integer_sums = np.add.reduceat(matrix, starts, axis = 0)
+        self.__integer_squares = np.add.reduceat(matrix ** 2, starts, \
+                                                 axis = 0)
+        stats = [self.__stats[i] for i in self.__floating]
+        matrix = self.__frame[stats].to_numpy(dtype = np.float64)
+        matrix = matrix[self.__order]
+        team_of_row = np.repeat(np.arange(len(self.__teams)), self.__counts)
+        self.__sums = np.add.reduceat(matrix, starts, axis = 0)
+        means = self.__sums / self.__counts[:, np.newaxis]
+        self.__squares = np.add.reduceat((matrix - means[team_of_row]) ** 2, \
+                                         starts, axis = 0)
+
+    # Purpose: Builds the count, sum, mean, median and standard deviation
+    #          frames from the accumulated sums. The aggregates without free
+    #          agents ('FA') are stored next to them, under (name, False)
+    #          keys.
+    # Arguments: None.
+    # Returns: Nothing.
+    def __build_aggregates(self):
+        counts = self.__counts[:, np.newaxis]
+        totals = np.empty((len(self.__teams), len(self.__stats)))
+        totals[:, self.__integer] = self.__integer_sums
+        totals[:, self.__floating] = self.__sums
+        # An integer stat's squared differences from the mean are its sum of
+        # squares less its squared sum over the count, which is exact in
+        # integers before the division.
+        squares = np.empty_like(totals)
+        squares[:, self.__integer] = (counts * self.__integer_squares - \
+                                      self.__integer_sums ** 2) / counts
+        squares[:, self.__floating] = self.__squares
+        means = totals / counts
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            stds = np.sqrt(np.maximum(squares, 0) / (counts - 1))
+        stds[self.__counts < 2] = np.nan
+        medians = np.column_stack([self.__stat_order.get_medians(\
+                                   'Team', stat, self.__teams) for stat in \
+                                   self.__stats])
+        index = pd.Index(self.__teams, name = 'Team')
+        sums = pd.DataFrame(totals, index = index, columns = self.__stats)
+        for j, i in enumerate(self.__integer):
+            sums[self.__stats[i]] = self.__integer_sums[:, j]
+        aggregates = \
+        {'count': pd.DataFrame(np.repeat(counts, len(self.__stats), \
+                                         axis = 1),
+                               index = index, columns = self.__stats),
+         'sum': sums,
+         'mean': pd.DataFrame(means, index = index, columns = self.__stats),
+         'median': pd.DataFrame(medians, index = index, \
+                                columns = self.__stats),
+         'std': pd.DataFrame(stds, index = index, columns = self.__stats)}
+        for aggregate in list(aggregates):
+            if 'FA' in self.__offsets:
+                aggregates[(aggregate, False)] = \
+                aggregates[aggregate].drop('FA')
+            else:
+                aggregates[(aggregate, False)] = aggregates[aggregate]
+        # Published whole, so a reader never sees some of the keys.
+        self.__aggregates = aggregates
+
+    # Purpose: Updates the aggregates after some rows' stats changed (their
+    #          teams must not change). The sums and squared differences are
+    #          adjusted by the changes, so no team is rescanned; the integer
+    #          stats' aggregates stay exactly those of a rebuild, and the
+    #          other stats' match it to floating-point precision. The frames
+    #          are rebuilt on the next request, with the medians read from the
+    #          (updated) order index.
+    # Arguments: A numpy array: the row positions that changed. A numpy
+    #            array: the rows' previous stats (one column per stat).
+    # Returns: Nothing.
+    def update(self, positions, previous):
+        with self.__lock:
+            self.__update(positions, previous)
+
+    # Purpose: Gets some rows' values of some stats.
+    # Arguments: A numpy array: the row positions. A numpy array: the stats'
+    #            columns. A dtype: the values' type.
+    # Returns: A numpy array: the values, one column per stat.
+    def __get_rows_values(self, positions, columns, dtype):
+        values = np.empty((len(positions), len(columns)), dtype = dtype)
+        for j, i in enumerate(columns):
+            values[:, j] = self.__frame[self.__stats[i]].to_numpy()[positions]
+        return values
+
+    # Purpose: Updates the aggregates (see update); the lock must be held.
+    # Arguments: A numpy array: the row positions that changed. A numpy
+    #            array: the rows' previous stats (one column per stat).
+    # Returns: Nothing.
+    def __update(self, positions, previous):
+        if self.__sums is None:
+            return
+        codes = self.__codes[positions]
+        current = self.__get_rows_values(positions, self.__integer, np.int64)
+        old = previous[:, self.__integer].astype(np.int64)
+        np.add.at(self.__integer_sums, codes, current - old)
+        np.add.at(self.__integer_squares, codes, current ** 2 - old ** 2)
+        current = self.__get_rows_values(positions, self.__floating, \
+                                         np.float64)
+        previous = previous[:, self.__floating]
+        sums = self.__sums.copy()
+        np.add.at(sums, codes, current - previous)
+        np.add.at(self.__squares, codes, current ** 2 - previous ** 2)
+        # The squared differences from the mean are the sum of squares less
+        # the squared sum over the count.
+        self.__squares -= (sums ** 2 - self.__sums ** 2) / \
+                          self.__counts[:, np.newaxis]
+        self.__sums = sums
+        self.__aggregates = None
+
+    # Purpose: Gets a team aggregate. All of the aggregates are computed on
+    #          the first request and memoized; the memo is updated (see
+    #          update) or the index rebuilt when the batters' stats change.
+    # Arguments: A string: the aggregate ('count', 'sum', 'mean', 'median' or
+    #            'std'). A boolean: whether to include free agents ('FA').
+    # Returns: A DataFrame: the aggregate, one row per team.
+    def get_aggregate(self, name, include_fas = False):
+        aggregates = self.__aggregates
+        if aggregates is None:
+            with self.__lock:
+                if self.__aggregates is None:
+                    if self.__sums is None:
+                        self.__accumulate()
+                    self.__build_aggregates()
+                aggregates = self.__aggregates
+        if include_fas:
+            return aggregates[name]
+        return aggregates[(name, False)]
+
+class SimilarityIndex(object):
+
+    # Purpose: Initializes the similarity index. Each stat is standardized
+    #          (to a mean of 0 and a standard deviation of 1, so stats on
+    #          different scales count alike) once, into one contiguous
+    #          float64 matrix with a row per player.
+    # Arguments: A DataFrame: the batters' stats. A list of strings: the
+    #            stats.
+    # Returns: Nothing.
+    def __init__(self, frame, stats = STATS):
+        self.__stats = list(stats)
+        matrix = np.empty((len(frame), len(stats)), dtype = np.float64)
+        for i, stat in enumerate(stats):
+            matrix[:, i] = frame[stat].to_numpy(dtype = np.float64)
+        means = matrix.mean(axis = 0)
+        deviations = matrix.std(axis = 0)
+        deviations[deviations == 0] = 1.0
+        matrix -= means
+        matrix /= deviations
+        self.__matrix = matrix
+        self.__at_bats = frame['AB'].to_numpy()
+        self.__prepared = None
+        self.__lock = threading.Lock()
+
+    # Purpose: Gets the stats the players are compared on.
+    # Arguments: None.
+    # Returns: A list of strings: the stats.
+    def get_stats(self):
+        return self.__stats
+
+    # Purpose: Gets the memory used by the index.
+    # Arguments: None.
+    # Returns: An int: the bytes used by the standardized stats and the
+    #          last candidates prepared.
+    def get_memory_usage(self):
+        usage = self.__matrix.nbytes + self.__at_bats.nbytes
+        prepared = self.__prepared
+        if prepared is not None:
+            usage += sum(array.nbytes for array in prepared[1] if \
+                         isinstance(array, np.ndarray))
+        return usage
+
+    # Purpose: Gets the candidate players and their weighted stats, sorted
+    #          along the weighted stats' principal axis. A stat's weight
+    #          scales its squared differences, and stats weighted 0 are left
+    #          out. The last candidates prepared are kept for the next search.
+    # Arguments: A dictionary: each stat with its weight (1 if not given).
+    #            An int: the fewest at bats a candidate can have.
+    # Returns: A tuple: the candidates' row positions, the stats' columns,
+    #          the square roots of their weights, the candidates' weighted
+    #          stats matrix, its rows' squared norms, the candidates'
+    #          positions along the axis (sorted) and the axis.
+    def __prepare(self, weights, min_ab):
+        key = (tuple(sorted((weights or {}).items())), min_ab)
+        with self.__lock:
+            if self.__prepared is not None and self.__prepared[0] == key:
+                return self.__prepared[1]
+            prepared = self.__prepare_candidates(weights, min_ab)
+            self.__prepared = (key, prepared)
+        return prepared
+
+    # Purpose: Prepares the candidate players (see __prepare).
+    # Arguments: A dictionary: each stat with its weight (1 if not given).
+    #            An int: the fewest at bats a candidate can have.
+    # Returns: A tuple: the prepared candidates (see __prepare).
+    def __prepare_candidates(self, weights, min_ab):
+        scales = np.ones(len(self.__stats))
+        for stat, weight in (weights or {}).items():
+            if stat not in self.__stats:
+                raise KeyError(stat)
+            if not weight >= 0:
+                raise ValueError("Invalid weight for %s: %s" % (stat, weight))
+            scales[self.__stats.index(stat)] = weight
+        columns = np.flatnonzero(scales)
+        roots = np.sqrt(scales[columns])
+        rows = np.flatnonzero(self.__at_bats >= min_ab)
+        matrix = self.__matrix[rows][:, columns] * roots
+        centered = matrix - matrix.mean(axis = 0)
+        axis = np.linalg.eigh(centered.T @ centered)[1][:, -1] if \
+               len(columns) else np.zeros(0)
+        projections = matrix @ axis
+        order = np.argsort(projections, kind = 'mergesort')
+        matrix = np.ascontiguousarray(matrix[order])
+        return (rows[order], columns, roots, matrix, \
+                np.einsum('ij,ij->i', matrix, matrix), projections[order], \
+                axis)
+
+    # Purpose: Finds some players' k nearest candidates within a slice of
+    #          the sorted candidates. The distances to a block of players are
+    #          one matrix product (less each player's own squared norm, which
+    #          doesn't change the order), and the blocks are sized to fit the
+    #          memory budget. The k nearest distances are then recomputed
+    #          directly, since the product loses precision for players who
+    #          are very close, and ties go to the earlier candidate.
+    # Arguments: A numpy array: the players' weighted stats. A numpy array:
+    #            the players' own candidate positions (-1 if they aren't
+    #            candidates). A tuple: the prepared candidates (see
+    #            __prepare). A tuple: the slice's start and end. An int: k.
+    #            An int: the memory budget (in bytes).
+    # Returns: A tuple: two numpy arrays with a row per player, the nearest
+    #          candidates' positions and their distances, nearest first
+    #          (padded with -1 and infinity if there are fewer than k).
+    def __nearest_in(self, queries, own, prepared, window, k, memory_budget):
+        matrix = prepared[3][window[0]:window[1]]
+        norms = prepared[4][window[0]:window[1]]
+        found = np.full((len(queries), k), -1, dtype = np.intp)
+        exact = np.full((len(queries), k), np.inf)
+        width = min(k, len(matrix))
+        if width == 0:
+            return found, exact
+        own = own - window[0]
+        # Per player, a block holds three float64 or intp arrays over the
+        # candidates (the distances, the partition's indices and a
+        # temporary), and the k nearest candidates' differences.
+        block = max(1, int(memory_budget // (24 * len(matrix) + \
+                                             16 * k * matrix.shape[1])))
+        for start in range(0, len(queries), block):
+            chunk = queries[start:start + block]
+            squares = chunk @ matrix.T
+            squares *= -2
+            squares += norms
+            mine = own[start:start + block]
+            inside = np.flatnonzero((mine >= 0) & (mine < len(matrix)))
+            squares[inside, mine[inside]] = np.inf
+            if width < len(matrix):
+                nearest = np.argpartition(squares, width - 1, \
+                                          axis = 1)[:, :width]
+            else:
+                nearest = np.broadcast_to(np.arange(width), \
+                                          squares.shape).copy()
+            close = np.take_along_axis(squares, nearest, axis = 1)
+            distances = np.sqrt(((chunk[:, None, :] - matrix[nearest]) ** 2)\
+                                .sum(axis = 2))
+            distances[np.isinf(close)] = np.inf
+            order = np.lexsort((nearest, distances), axis = 1)
+            found[start:start + block, :width] = \
+            np.take_along_axis(nearest, order, axis = 1) + window[0]
+            exact[start:start + block, :width] = \
+            np.take_along_axis(distances, order, axis = 1)
+        return found, exact
+
+    # Purpose: Finds each of some players' k nearest players, by Euclidean
+    #          distance between weighted, standardized stats (players are
+    #          never their own neighbors). The players are searched in blocks,
+    #          in order along the candidates' principal axis. A block first
+    #          searches the candidates next to it along the axis; no nearer
+    #          candidate can be farther along the axis than the farthest of
+    #          those neighbors, so the block then only searches the slice of
+    #          candidates within that reach.
+    # Arguments: A numpy array: the players' row positions. An int: k. A
+    #            dictionary: each stat with its weight. An int: the fewest
+    #            at bats a neighbor can have. An int: the memory budget (in
+    #            bytes) for a block's distances.
+    # Returns: A tuple: two numpy arrays with a row per player, the
+    #          neighbors' row positions and their distances, nearest first
+    #          (padded with -1 and infinity if there are fewer than k).
+    def nearest(self, positions, k, weights = None, min_ab = 0, \
+                memory_budget = SIMILARITY_MEMORY):
+        positions = np.asarray(positions, dtype = np.intp).reshape(-1)
+        prepared = self.__prepare(weights, min_ab)
+        rows, columns, roots, projections, axis = \
+        prepared[0], prepared[1], prepared[2], prepared[5], prepared[6]
+        k = max(0, min(k, len(rows)))
+        neighbors = np.full((len(positions), k), -1, dtype = np.intp)
+        distances = np.full((len(positions), k), np.inf)
+        if k == 0 or len(positions) == 0:
+            return neighbors, distances
+        candidates = np.full(len(self.__matrix), -1, dtype = np.intp)
+        candidates[rows] = np.arange(len(rows))
+        queries = self.__matrix[positions][:, columns] * roots
+        reaches = queries @ axis
+        query_order = np.argsort(reaches, kind = 'mergesort')
+        for start in range(0, len(positions), SIMILARITY_BLOCK):
+            block = query_order[start:start + SIMILARITY_BLOCK]
+            low, high = reaches[block[0]], reaches[block[-1]]
+            pad = k + SIMILARITY_WINDOW
+            window = (max(0, np.searchsorted(projections, low) - pad), \
+                      min(len(rows), np.searchsorted(projections, high, \
+                                                     'right') + pad))
+            found, exact = self.__nearest_in(queries[block], \
+                                             candidates[positions[block]], \
+                                             prepared, window, k, \
+                                             memory_budget)
+            if window != (0, len(rows)):
+                # The margin covers the projections' rounding.
+                reach = exact[:, -1].max() * (1 + 1e-9) + 1e-9
+                window = (np.searchsorted(projections, low - reach), \
+                          np.searchsorted(projections, high + reach, \
+                                          'right'))
+                found, exact = self.__nearest_in(queries[block], \
+                               candidates[positions[block]], prepared, \
+                               window, k, memory_budget)
+            neighbors[block] = np.where(np.isinf(exact), -1, rows[found])
+            distances[block] = exact
+        return neighbors, distances
+
+    # Purpose: Finds every candidate player's k nearest players (see
+    #          nearest), in blocks that fit the memory budget.
+    # Arguments: An int: k. A dictionary: each stat with its weight. An int:
+    #            the fewest at bats a player can have. An int: the memory
+    #            budget (in bytes) for a block's distances.
+    # Returns: A tuple: the players' row positions, and their neighbors' row
+    #          positions and distances (see nearest).
+    def all_nearest(self, k, weights = None, min_ab = 0, \
+                    memory_budget = SIMILARITY_MEMORY):
+        rows = np.flatnonzero(self.__at_bats >= min_ab)
+        return (rows,) + self.nearest(rows, k, weights, min_ab, \
+                                      memory_budget)
+
+# Purpose: Normalizes a player's name for lookups: accents are stripped, the
+#          name is case folded, periods and apostrophes are dropped, hyphens
+#          become spaces and runs of whitespace are collapsed. E.g.
+#          "O'Neil, J.D." and "oneil, jd" have the same key.
+# Arguments: A string: the name ("Last, First").
+# Returns: A string: the normalized name.
+def normalize_name(name):
+    name = unicodedata.normalize('NFKD', str(name))
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    name = name.casefold().replace("'", '').replace('.', '')
+    name = name.replace('-', ' ')
+    return ', '.join(' '.join(part.split()) for part in name.split(','))
+
+class PlayerIndex(object):
+
+    # Purpose: Initializes the player name index. Each row's player id is its
+    #          row position. Names are looked up exactly through a dictionary
+    #          of normalized names, by prefix through a sorted list of
+    #          normalized "last, first" and "first last" names, and
+    #          approximately through an inverted index of each name's
+    #          trigrams.
+    # Arguments: A list of strings: the players' names, one per row.
+    # Returns: Nothing.
+    def __init__(self, names):
+        self.__names = [str(name).strip() for name in names]
+        self.__exact = {}
+        prefixes = []
+        postings = {}
+        self.__num_grams = np.zeros(len(self.__names))
+        for player_id, name in enumerate(self.__names):
+            key = normalize_name(name)
+            self.__exact.setdefault(key, []).append(player_id)
+            prefixes.append((key, player_id))
+            if ', ' in key:
+                last, first = key.split(', ', 1)
+                prefixes.append((first + ' ' + last, player_id))
+            grams = self.__get_grams(key)
+            self.__num_grams[player_id] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(player_id)
+        prefixes.sort()
+        self.__prefix_keys = [key for key, player_id in prefixes]
+        self.__prefix_ids = [player_id for key, player_id in prefixes]
+        self.__postings = dict((gram, np.array(ids)) for gram, ids in \
+                               postings.items())
+
+    # Purpose: Gets the trigrams of a normalized name's words.
+    # Arguments: A string: the normalized name.
+    # Returns: A set of strings: the trigrams.
+    def __get_grams(self, key):
+        grams = set()
+        for word in key.replace(',', ' ').split():
+            word = '  ' + word + ' '
+            for i in range(len(word) - 2):
+                grams.add(word[i:i + 3])
+        return grams
+
+    # Purpose: Gets the number of players in the index.
+    # Arguments: None.
+    # Returns: An int: the number of players.
+    def __len__(self):
+        return len(self.__names)
+
+    # Purpose: Gets the (approximate) memory used by the index: the Python
+    #          containers and strings are measured with sys.getsizeof.
+    # Arguments: None.
+    # Returns: An int: the bytes used by the names, the name dictionary,
+    #          the prefix lists and the trigram postings.
+    def get_memory_usage(self):
+        usage = sys.getsizeof(self.__names) + \
+                sum(sys.getsizeof(name) for name in self.__names)
+        usage += sys.getsizeof(self.__exact) + \
+                 sum(sys.getsizeof(key) + sys.getsizeof(ids) for key, ids in \
+                     self.__exact.items())
+        usage += sys.getsizeof(self.__prefix_keys) + \
+                 sys.getsizeof(self.__prefix_ids) + \
+                 sum(sys.getsizeof(key) for key in self.__prefix_keys)
+        usage += sys.getsizeof(self.__postings) + \
+                 sum(sys.getsizeof(gram) + ids.nbytes for gram, ids in \
+                     self.__postings.items())
+        return usage + self.__num_grams.nbytes
+
+    # Purpose: Gets a player's name.
+    # Arguments: An int: the player id.
+    # Returns: A string: the player's name.
+    def get_name(self, player_id):
+        return self.__names[player_id]
+
+    # Purpose: Gets the ids of the players with a name.
+    # Arguments: A string: the name ("Last, First"), in any case and with or
+    #            without accents and punctuation.
+    # Returns: A list of ints: the player ids (empty if there is no such
+    #          player; more than one if players share the name).
+    def get_ids(self, name):
+        return self.__exact.get(normalize_name(name), [])
+
+    # Purpose: Finds the players whose "last, first" or "first last" name
+    #          starts with a prefix.
+    # Arguments: A string: the prefix. An int: the maximum number of players.
+    # Returns: A list of ints: the player ids, sorted by name.
+    def find_prefix(self, prefix, limit = 10):
+        prefix = normalize_name(prefix)
+        player_ids = []
+        i = bisect.bisect_left(self.__prefix_keys, prefix)
+        while i < len(self.__prefix_keys) and len(player_ids) < limit and \
+              self.__prefix_keys[i].startswith(prefix):
+            if self.__prefix_ids[i] not in player_ids:
+                player_ids.append(self.__prefix_ids[i])
+            i += 1
+        return player_ids
+
+    # Purpose: Finds the players whose names are most similar to a name, by
+    #          the Dice coefficient of the names' trigrams. Only the players
+    #          sharing a trigram with the name are scored.
+    # Arguments: A string: the name. An int: the number of players. A float:
+    #            the minimum score (between 0 and 1).
+    # Returns: A list of tuples: each player id and score, best first.
+    def find_similar(self, name, k = 10, min_score = 0.0):
+        grams = self.__get_grams(normalize_name(name))
+        shared = np.zeros(len(self.__names))
+        for gram in grams:
+            if gram in self.__postings:
+                shared[self.__postings[gram]] += 1
+        scores = 2 * shared / (len(grams) + self.__num_grams)
+        candidates = np.flatnonzero((shared > 0) & (scores >= min_score))
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], \
+                                                    k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], \
+                                           kind = 'mergesort')]
+        return [(int(player_id), float(scores[player_id])) for player_id in \
+                candidates]
+
+# Purpose: Converts the batters' stats to a compact layout: Team and POS
+#          become categoricals, the counting stats get the narrowest integer
+#          dtype that holds their values, the rate stats become float32, and
+#          the player names move out of the index into a side table (the
+#          index becomes the player id).
+# Arguments: A DataFrame: the batters' stats, indexed by player name.
+# Returns: A tuple: the compact DataFrame and a numpy array of the player
+#          names (indexed by player id).
+def compact_batter_stats(batter_stats):
+    columns = {}
+    for column in batter_stats.columns:
+        values = batter_stats[column].reset_index(drop = True)
+        if column in ('Team', 'POS'):
+            values = values.astype('category')
+        elif np.issubdtype(values.dtype, np.integer):
+            if len(values) and values.min() >= 0:
+                values = pd.to_numeric(values, downcast = 'unsigned')
+            else:
+                values = pd.to_numeric(values, downcast = 'integer')
+        elif np.issubdtype(values.dtype, np.floating):
+            values = values.astype(np.float32)
+        columns[column] = values
+    compact = pd.DataFrame(columns)
+    compact.index = pd.RangeIndex(len(compact), name = 'PLAYER_ID')
+    names = batter_stats.index.to_numpy(dtype = object)
+    return compact, names
+
+# Purpose: Reads a game results file: one line per game with the Home and
+#          Away teams (abbreviations or full names) and the Home_Score and
+#          Away_Score. Games not played yet have no scores.
+# Arguments: A string: the path to a CSV file or a JSON lines file ('.jsonl'
+#            or '.json').
+# Returns: A DataFrame: the games.
+def read_game_results(path):
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        return pd.read_json(path, lines = True, dtype = {'Home': str, \
+                                                         'Away': str})
+    return pd.read_csv(path, dtype = {'Home': str, 'Away': str})
+
+# Purpose: Divides wins by games, with a default for no games.
+# Arguments: A numpy array: the wins. A numpy array: the games. A float: the
+#            default.
+# Returns: A numpy array of floats: the winning percentages.
+def win_ratio(wins, games, default = 0.5):
+    return np.where(games > 0, wins / np.maximum(games, 1), default)
+
+class Standings(object):
+
+    # Purpose: Initializes the standings from game results. The wins, losses,
+    #          head-to-head records and run differentials are accumulated
+    #          over every played game at once, and the unplayed games are
+    #          kept as the remaining schedule.
+    # Arguments: A DataFrame: the games (see read_game_results).
+    # Returns: Nothing.
+    def __init__(self, results):
+        self.__teams = np.array([team for division in DIVISIONS.values() \
+                                 for team in division])
+        self.__divisions = np.repeat(np.arange(len(DIVISIONS)), \
+                                     [len(division) for division in \
+                                      DIVISIONS.values()])
+        self.__leagues = np.array([name.split()[0] for name in \
+                                   DIVISIONS])[self.__divisions]
+        home = self.__get_codes(results['Home'])
+        away = self.__get_codes(results['Away'])
+        home_scores = pd.to_numeric(results['Home_Score']).to_numpy()
+        away_scores = pd.to_numeric(results['Away_Score']).to_numpy()
+        played = ~(np.isnan(home_scores) | np.isnan(away_scores))
+        decided = played & (home_scores != away_scores)
+        home_won = home_scores[decided] > away_scores[decided]
+        winners = np.where(home_won, home[decided], away[decided])
+        losers = np.where(home_won, away[decided], home[decided])
+        num_teams = len(self.__teams)
+        self.__wins = np.bincount(winners, minlength = num_teams)
+        self.__losses = np.bincount(losers, minlength = num_teams)
+        self.__head_to_head = np.zeros((num_teams, num_teams), \
+                                       dtype = np.int64)
+        np.add.at(self.__head_to_head, (winners, losers), 1)
+        margins = home_scores[played] - away_scores[played]
+        self.__run_differentials = \
+        np.bincount(home[played], margins, minlength = num_teams) - \
+        np.bincount(away[played], margins, minlength = num_teams)
+        self.__remaining = (home[~played], away[~played])
+        games = self.__head_to_head + self.__head_to_head.T
+        same_division = self.__divisions[:, np.newaxis] == \
+                        self.__divisions[np.newaxis, :]
+        same_league = self.__leagues[:, np.newaxis] == \
+                      self.__leagues[np.newaxis, :]
+        self.__same_division = same_division
+        self.__same_league = same_league
+        self.__division_pcts = \
+        win_ratio((self.__head_to_head * same_division).sum(axis = 1), \
+                  (games * same_division).sum(axis = 1))
+        self.__league_pcts = \
+        win_ratio((self.__head_to_head * same_league).sum(axis = 1), \
+                  (games * same_league).sum(axis = 1))
+
+    # Purpose: Converts teams (abbreviations or full names) to team codes.
+    # Arguments: A Series: the teams.
+    # Returns: A numpy array of ints: the codes (positions in DIVISIONS).
+    def __get_codes(self, teams):
+        codes = dict((team, i) for i, team in enumerate(self.__teams))
+        for name, abbrev in TEAM_ABBREVIATIONS.items():
+            codes[name.upper()] = codes[abbrev]
+        teams = teams.astype(str).str.strip().str.upper()
+        unknown = sorted(set(teams) - set(codes))
+        if unknown:
+            raise ValueError("Unknown team(s): " + ", ".join(unknown))
+        return teams.map(codes).to_numpy(dtype = np.intp)
+
+    # Purpose: Orders teams by winning percentage. Ties are broken by the
+    #          record between the tied teams, then the record within the
+    #          division, then within the league, then the run differential
+    #          and last the team's abbreviation.
+    # Arguments: A numpy array: the team codes to order.
+    # Returns: A numpy array: the team codes, best first.
+    def __order(self, teams):
+        wins = self.__wins[teams]
+        losses = self.__losses[teams]
+        pcts = win_ratio(wins, wins + losses, 0.0)
+        head_to_head = self.__head_to_head[np.ix_(teams, teams)]
+        tied = pcts[:, np.newaxis] == pcts[np.newaxis, :]
+        tied_pcts = win_ratio((head_to_head * tied).sum(axis = 1), \
+                              ((head_to_head + head_to_head.T) * \
+                               tied).sum(axis = 1))
+        return teams[np.lexsort((self.__teams[teams], \
+                                 -self.__run_differentials[teams], \
+                                 -self.__league_pcts[teams], \
+                                 -self.__division_pcts[teams], -tied_pcts, \
+                                 -pcts))]
+
+    # Purpose: Gets the standings, overall or by division.
+    # Arguments: A boolean: whether to rank the teams within their divisions
+    #            (with games back) instead of overall.
+    # Returns: A DataFrame: the standings, indexed by rank (and division).
+    def get_table(self, by_division = False):
+        if by_division:
+            parts = []
+            for i, division in enumerate(DIVISIONS):
+                teams = self.__order(np.flatnonzero(self.__divisions == i))
+                leader = teams[0]
+                games_back = ((self.__wins[leader] - self.__wins[teams]) + \
+                              (self.__losses[teams] - \
+                               self.__losses[leader])) / 2.0
+                part = self.__describe(teams)
+                part['Games Back'] = games_back
+                part.index = pd.MultiIndex.from_arrays(\
+                             [[division] * len(teams), \
+                              range(1, len(teams) + 1)], \
+                             names = ['Division', 'Rankings'])
+                parts.append(part)
+            return pd.concat(parts)
+        teams = self.__order(np.arange(len(self.__teams)))
+        table = self.__describe(teams)
+        table['League'] = self.__leagues[teams]
+        table.index = pd.Index(range(1, len(teams) + 1), name = 'Rankings')
+        return table
+
+    # Purpose: Gets the teams' names and records.
+    # Arguments: A numpy array: the team codes.
+    # Returns: A DataFrame: the teams' names, wins, losses and winning
+    #          percentages.
+    def __describe(self, teams):
+        wins = self.__wins[teams]
+        losses = self.__losses[teams]
+        return pd.DataFrame({'Team': [TEAM_NAMES[team] for team in \
+                                      self.__teams[teams]],
+                             'Wins': wins,
+                             'Losses': losses,
+                             'Winning Pct': win_ratio(wins, wins + losses, \
+                                                      0.0)})
+
+    # Purpose: Estimates each team's playoff odds by playing out the
+    #          remaining schedule many times. Each remaining game is won by
+    #          the home team with the log5 probability from the two teams'
+    #          records (each regressed toward .500 by 20 games), and each
+    #          simulated season's teams are ordered as the standings order
+    #          them (see best_simulated_teams for the tie-breaks). The seasons
+    #          are simulated in batches of NumPy draws, and the batches are
+    #          spread across a process pool. Each batch has its own seed
+    #          derived from the seed, so the odds depend only on the seed, the
+    #          number of simulations and the batch size.
+    # Arguments: An int: the number of simulated seasons. An int: the random
+    #            seed (None for a random one). An int: the number of
+    #            processes (defaults to the number of CPUs; 1 simulates in
+    #            this process). An int: the seasons per batch.
+    # Returns: A DataFrame: each team's record, projected wins and the
+    #          percentages of seasons it won the division, won a wild card
+    #          and made the playoffs, sorted by playoff odds. Raises a
+    #          ValueError if the number of simulations or the batch size is
+    #          less than 1.
+    def get_playoff_odds(self, num_simulations = 100000, seed = None, \
+                         processes = None, batch_size = 2000):
+        if num_simulations < 1:
+            raise ValueError("Invalid number of simulations: %s" % \
+                             (num_simulations,))
+        if batch_size < 1:
+            raise ValueError("Invalid batch size: %s" % (batch_size,))
+        strengths = (self.__wins + 10.0) / (self.__wins + self.__losses + \
+                                            20.0)
+        home, away = self.__remaining
+        home_odds = strengths[home] * (1 - strengths[away])
+        away_odds = strengths[away] * (1 - strengths[home])
+        probabilities = (home_odds / (home_odds + away_odds)).astype(\
+                        np.float32)
+        sizes = [batch_size] * (num_simulations // batch_size)
+        if num_simulations % batch_size:
+            sizes.append(num_simulations % batch_size)
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        divisions = [np.flatnonzero(self.__divisions == i) for i in \
+                     range(len(DIVISIONS))]
+        leagues = [np.flatnonzero(self.__leagues == league) for league in \
+                   np.unique(self.__leagues)]
+        tie_breaks = (self.__same_division, self.__same_league, \
+                      self.__run_differentials, \
+                      np.argsort(np.argsort(self.__teams)))
+        tasks = [(size, batch_seed, self.__head_to_head, home, away, \
+                  probabilities, tie_breaks, divisions, leagues) for size, \
+                 batch_seed in zip(sizes, seeds)]
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if processes <= 1 or len(tasks) <= 1:
+            counts = [simulate_playoffs(task) for task in tasks]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(processes) as \
+                 executor:
+                counts = list(executor.map(simulate_playoffs, tasks))
+        counts = np.sum(counts, axis = 0) / float(num_simulations)
+        odds = pd.DataFrame({'Division': [division for division in \
+                                          DIVISIONS for team in \
+                                          DIVISIONS[division]],
+                             'Wins': self.__wins,
+                             'Losses': self.__losses,
+                             'Projected Wins': counts[0].round(1),
+                             'Division Pct': (100 * counts[1]).round(1),
+                             'Wild Card Pct': (100 * counts[2]).round(1),
+                             'Playoff Pct': (100 * (counts[1] + \
+                                                    counts[2])).round(1)},
+                            index = pd.Index([TEAM_NAMES[team] for team in \
+                                              self.__teams], name = 'Team'))
+        return odds.sort_values(['Playoff Pct', 'Projected Wins'], \
+                                ascending = False, kind = 'mergesort')
+
+# Purpose: Finds the best teams in each simulated season, ordering the
+#          teams the way Standings orders them: by winning percentage, then
+#          the record between the tied teams, the division record, the
+#          league record, the run differential and last the abbreviation.
+#          Ineligible teams (e.g. division champions, when finding the wild
+#          cards) are never chosen and don't count in the tied teams'
+#          records. The tie-breaks are only computed for the seasons where
+#          the last team chosen is tied with the next one.
+# Arguments: A numpy array: the team codes. An int: the number of teams to
+#            choose. Three numpy arrays: each season's winning, division
+#            and league percentages (seasons by teams). A tuple: the
+#            remaining games' results (seasons by games; 1 if the home team
+#            won), the head-to-head wins so far, the games' home and away
+#            team codes, the run differentials and the teams' ranks by
+#            abbreviation. A numpy array of booleans: each season's
+#            eligible teams (None if every team is).
+# Returns: A numpy array: each season's chosen team codes (seasons by
+#          teams chosen).
+def best_simulated_teams(teams, count, pcts, division_pcts, league_pcts, \
+                         records, eligible = None):
+    home_won, head_to_head, home, away, run_differentials, name_ranks = \
+    records
+    num_teams = len(teams)
+    if eligible is None:
+        eligible = np.ones((len(pcts), num_teams), dtype = bool)
+    else:
+        eligible = eligible[:, teams]
+    team_pcts = pcts[:, teams]
+    scores = np.where(eligible, team_pcts, -np.inf)
+    best = np.argsort(-scores, axis = 1, kind = 'stable')
+    chosen = teams[best[:, :count]]
+    ranked = np.take_along_axis(scores, best, axis = 1)
+    seasons = np.flatnonzero(ranked[:, count - 1] == ranked[:, count]) if \
+              count < num_teams else np.array([], dtype = np.intp)
+    if not len(seasons):
+        return chosen
+    team_pcts = team_pcts[seasons]
+    eligible = eligible[seasons]
+    tied = (team_pcts[:, :, np.newaxis] == team_pcts[:, np.newaxis, :]) & \
+           eligible[:, :, np.newaxis] & eligible[:, np.newaxis, :]
+    # Each season's head-to-head wins between the teams, flattened: a game
+    # adds a win to its away team, which moves to its home team if the home
+    # team won.
+    local = np.full(len(head_to_head), -1)
+    local[teams] = np.arange(num_teams)
+    games = np.flatnonzero((local[home] >= 0) & (local[away] >= 0))
+    home_pairs = local[home[games]] * num_teams + local[away[games]]
+    away_pairs = local[away[games]] * num_teams + local[home[games]]
+    swing = np.zeros((len(games), num_teams * num_teams), dtype = np.float32)
+    swing[np.arange(len(games)), home_pairs] = 1
+    swing[np.arange(len(games)), away_pairs] = -1
+    wins = head_to_head[np.ix_(teams, teams)].ravel() + \
+           np.bincount(away_pairs, minlength = num_teams * num_teams)
+    wins = wins + np.rint(home_won[np.ix_(seasons, games)] @ swing)\
+                  .astype(np.int64)
+    wins = wins.reshape(len(seasons), num_teams, num_teams)
+    tied_pcts = win_ratio((wins * tied).sum(axis = 2), \
+                          ((wins + wins.transpose(0, 2, 1)) * \
+                           tied).sum(axis = 2))
+    shape = tied_pcts.shape
+    keys = (np.broadcast_to(name_ranks[teams], shape), \
+            np.broadcast_to(-run_differentials[teams], shape), \
+            -league_pcts[np.ix_(seasons, teams)], \
+            -division_pcts[np.ix_(seasons, teams)], -tied_pcts, \
+            -team_pcts, ~eligible)
+    chosen[seasons] = teams[np.lexsort(keys, axis = -1)[:, :count]]
+    return chosen
+
+# Purpose: Simulates a batch of seasons' remaining games (see
+#          Standings.get_playoff_odds). A module-level function, so that a
+#          process pool can run it. Each season's teams are ordered as the
+#          standings would order them (see best_simulated_teams); the run
+#          differentials are the current ones, since the simulated games
+#          have no scores.
+# Arguments: A tuple: the number of seasons, the batch's SeedSequence, the
+#            head-to-head wins so far, the remaining games' home and away
+#            team codes, the home teams' win probabilities, the tie-breaks
+#            (the same-division and same-league matrices, the run
+#            differentials and the teams' ranks by abbreviation), and the
+#            team codes of each division and each league.
+# Returns: A numpy array: for each team, the total wins over the seasons and
+#          the numbers of division titles and wild cards.
+def simulate_playoffs(task):
+    num_seasons, seed, head_to_head, home, away, probabilities, \
+    tie_breaks, divisions, leagues = task
+    same_division, same_league, run_differentials, name_ranks = tie_breaks
+    rng = np.random.default_rng(seed)
+    num_teams = len(head_to_head)
+    schedule = head_to_head + head_to_head.T
+    np.add.at(schedule, (home, away), 1)
+    np.add.at(schedule, (away, home), 1)
+    home_won = (rng.random((num_seasons, len(home)), dtype = np.float32) < \
+                probabilities).astype(np.float32)
+    # A game adds a win to its away team, which moves to its home team if
+    # the home team won, so one matrix product totals every season's wins
+    # (overall, and within the division and the league).
+    swing = np.zeros((len(home), num_teams), dtype = np.float32)
+    swing[np.arange(len(home)), home] = 1
+    swing[np.arange(len(home)), away] = -1
+    pcts = []
+    for same, default in ((None, 0.0), (same_division, 0.5), \
+                          (same_league, 0.5)):
+        if same is None:
+            same = np.ones((num_teams, num_teams), dtype = bool)
+        games = same[home, away]
+        wins = (head_to_head * same).sum(axis = 1) + \
+               np.bincount(away[games], minlength = num_teams) + \
+               np.rint(home_won[:, games] @ swing[games]).astype(np.int64)
+        if not pcts:
+            total_wins = wins
+        pcts.append(win_ratio(wins, (schedule * same).sum(axis = 1), \
+                              default))
+    records = (home_won, head_to_head, home, away, run_differentials, \
+               name_ranks)
+    seasons = np.arange(num_seasons)[:, np.newaxis]
+    champions = np.zeros(total_wins.shape, dtype = bool)
+    for division in divisions:
+        best = best_simulated_teams(division, 1, *pcts, records)[:, 0]
+        champions[seasons[:, 0], best] = True
+    wild_cards = np.zeros(total_wins.shape, dtype = bool)
+    for league in leagues:
+        best = best_simulated_teams(league, WILD_CARDS, *pcts, records, \
+                                    eligible = ~champions)
+        wild_cards[seasons, best] = True
+    return np.array([total_wins.sum(axis = 0), champions.sum(axis = 0), \
+                     wild_cards.sum(axis = 0)])
+
+# Purpose: Summarizes values along their last axis.
+# Arguments: A numpy array: the values. A string: the summary ('mean',
+#            'median' or 'std', the sample standard deviation).
+# Returns: A numpy array: the summaries (NaN for the standard deviation of
+#          one value).
+def summarize(values, summary):
+    if summary == 'mean':
+        return values.mean(axis = -1)
+    if summary == 'median':
+        return np.median(values, axis = -1)
+    if summary == 'std':
+        deviations = values - values.mean(axis = -1, keepdims = True)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return np.sqrt((deviations ** 2).sum(axis = -1) / \
+                           (values.shape[-1] - 1))
+    raise ValueError("Invalid summary: %s" % (summary,))
+
+# Purpose: Summarizes a batch of bootstrap resamples (see
+#          bootstrap_intervals). A module-level function, so that a process
+#          pool can run it.
+# Arguments: A tuple: the number of resamples, the batch's SeedSequence, the
+#            values (a row per stat, with each group's columns together),
+#            the groups' bounds and the summary.
+# Returns: A numpy array: each resample's summary of each group's stats
+#          (resamples by groups by stats).
+def bootstrap_summaries(task):
+    num_resamples, seed, values, bounds, summary = task
+    rng = np.random.default_rng(seed)
+    summaries = np.empty((num_resamples, len(bounds) - 1, len(values)))
+    resamples = np.arange(num_resamples)[:, np.newaxis]
+    for group in range(len(bounds) - 1):
+        group_values = values[:, bounds[group]:bounds[group + 1]]
+        size = group_values.shape[1]
+        if summary == 'median':
+            # Drawing players is drawing their ranks in a stat, so a
+            # resample's median is at the same sorted positions in every
+            # stat. Those are the middle order statistics of the size's
+            # uniform draws: the k-th smallest is Beta(k, size + 1 - k)
+            # distributed, and the next is the smallest of the other draws,
+            # which are uniform above it.
+            middle = (size + 1) // 2
+            low = rng.beta(middle, size + 1 - middle, num_resamples)
+            high = low
+            if size % 2 == 0:
+                high = low + (1 - low) * rng.beta(1, size - middle, \
+                                                  num_resamples)
+            low = np.minimum((low * size).astype(np.intp), size - 1)
+            high = np.minimum((high * size).astype(np.intp), size - 1)
+            ordered = np.sort(group_values, axis = 1)
+            summaries[:, group] = (ordered[:, low] + ordered[:, high]).T / 2
+            continue
+        # Each resample is a row of positions in the group, drawn with
+        # replacement.
+        draws = rng.integers(0, size, (num_resamples, size))
+        # How many times each resample drew each player, so the sums of
+        # every stat are one matrix product.
+        counts = np.bincount((draws + resamples * size).ravel(), \
+                             minlength = num_resamples * size)
+        counts = counts.reshape(num_resamples, size).astype(np.float64)
+        means = group_values.mean(axis = 1)
+        centered = group_values - means[:, np.newaxis]
+        sums = counts @ centered.T
+        if summary == 'mean':
+            summaries[:, group] = sums / size + means
+        elif summary == 'std':
+            squares = counts @ (centered ** 2).T
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                summaries[:, group] = np.sqrt(np.maximum(squares - sums ** \
+                                              2 / size, 0) / (size - 1))
+        else:
+            raise ValueError("Invalid summary: %s" % (summary,))
+    return summaries
+
+# Purpose: Computes bootstrap (percentile) confidence intervals for a
+#          summary of each group of each stat. The resamples are drawn in
+#          batches that fit BOOTSTRAP_MEMORY, and the batches are spread
+#          across a process pool. Each batch has its own seed derived from
+#          the seed, so the intervals depend only on the seed, the number of
+#          resamples and the values' shape.
+# Arguments: A numpy array: the values (a row per stat, with each group's
+#            columns together). A numpy array: the groups' bounds (e.g.
+#            [0, 20, 45] for groups of 20 and 25). A string: the summary
+#            (see summarize). An int: the number of resamples. A float: the
+#            confidence level. An int: the random seed (None for a random
+#            one). An int: the number of processes (defaults to the number
+#            of CPUs; 1 resamples in this process).
+# Returns: A tuple: three numpy arrays (groups by stats), the summaries of
+#          the values and the intervals' lower and upper bounds.
+def bootstrap_intervals(values, bounds, summary, num_resamples = 10000, \
+                        confidence = 0.95, seed = None, processes = None):
+    if not 0 < confidence < 1:
+        raise ValueError("Invalid confidence: %s" % (confidence,))
+    if num_resamples < 1:
+        raise ValueError("Invalid number of resamples: %s" % \
+                         (num_resamples,))
+    values = np.ascontiguousarray(values, dtype = np.float64)
+    bounds = np.asarray(bounds, dtype = np.intp)
+    estimates = np.array([summarize(values[:, bounds[i]:bounds[i + 1]], \
+                                    summary) for i in range(len(bounds) - 1)])
+    # A resample's draws, their flat positions and counts (twice), and its
+    # summaries.
+    batch_size = max(1, int(BOOTSTRAP_MEMORY // \
+                            (8 * (4 * np.diff(bounds).max() + \
+                                  3 * len(values)))))
+    sizes = [batch_size] * (num_resamples // batch_size)
+    if num_resamples % batch_size:
+        sizes.append(num_resamples % batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(size, batch_seed, values, bounds, summary) for size, \
+             batch_seed in zip(sizes, seeds)]
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1 or len(tasks) <= 1:
+        summaries = [bootstrap_summaries(task) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            summaries = list(executor.map(bootstrap_summaries, tasks))
+    tail = (1 - confidence) / 2
+    lower, upper = np.quantile(np.concatenate(summaries), [tail, 1 - tail], \
+                               axis = 0)
+    return estimates, lower, upper
 
 class BaseballAnalytics(object):
 
     # Purpose: Initializes all class variables.
-    # Arguments: None.
+    # Arguments: A string: the path to the stats workbook. A boolean: whether
+    #            to load the batters' stats through the columnar cache. A
+    #            boolean: whether to store the batters' stats in the compact
+    #            layout (see compact_batter_stats).
+    #            A string: the sheet name. An int: the season (defaults to
+    #            the year in the stats file's name). The stats file can be a
+    #            directory or JSON manifest of season workbooks as well (see
+    #            SeasonStore); this object then holds the latest season, and
+    #            the other seasons are loaded when they are used. A
+    #            SeasonStore: the store this season belongs to (optional; it
+    #            is shared by the seasons loaded through it).
     # Returns: Nothing.
-    def __init__(self):
-        stats_file = pd.ExcelFile('mlb-stats2016.xlsx')
-        self.__batter_stats = stats_file.parse('Batters')
-        self.__batter_stats.index = self.__batter_stats['PLAYER']
-        self.__batter_stats = self.__batter_stats.drop('PLAYER', axis = 1)
-        self.__batter_stats.index = self.__batter_stats.index.map(str.title)
+    def __init__(self, stats_file = 'mlb-stats2016.xlsx', use_cache = True, \
+                 compact = False, sheet = 'Batters', season = None, \
+                 store = None):
+        self.__store = store
+        if store is None and (os.path.isdir(stats_file) or \
+                              stats_file.endswith('.json')):
+            self.__store = SeasonStore(stats_file, use_cache, compact)
+            season = self.__store.get_seasons()[-1]
+            stats_file, sheet = self.__store.get_workbook(season)
+            self.__store.add_resident(season, self)
+        # Whether the season was given (by the caller or a season store),
+        # rather than guessed from the workbook's name.
+        self.__season_given = season is not None
+        self.__season = season if season is not None else \
+                        season_from_name(stats_file)
+        self.__use_cache = use_cache
+        self.__compact = compact
+        self.__stats_file = stats_file
+        self.__batter_stats, self.__load_source, self.__load_time = \
+        load_batter_stats(stats_file, sheet, use_cache)
+        self.__player_names = None
+        if compact:
+            self.__batter_stats, self.__player_names = \
+            compact_batter_stats(self.__batter_stats)
+        # Guards the lazily built tables and indexes, which the query
+        # server's threads can request at once.
+        self.__lock = threading.Lock()
+        self.__derived_stats = DerivedStats(DERIVED_STATS)
+        self.__build_indexes()
+        self.__standings = None
         standings = {"arizona diamondbacks": (69, 93), \
                      "atlanta braves": (68, 93), \
                      "baltimore orioles": (89, 73), \
@@ -69,122 +1944,810 @@ class BaseballAnalytics(object):
         self.__standings_frame['Team'] = \
         self.__standings_frame['Team'].map(str.title)
 
+    # Purpose: Builds the indexes over the batters' stats. This must be
+    #          called again whenever the batters' stats change.
+    # Arguments: None.
+    # Returns: Nothing.
+    def __build_indexes(self):
+        self.__stat_percentiles = None
+        self.__derived = None
+        self.__similarity = None
+        self.__stat_order = StatOrderIndex(self.__batter_stats, STATS, \
+                                           compact = self.__compact)
+        self.__team_index = TeamIndex(self.__batter_stats, STATS, \
+                                      self.__stat_order)
+        if self.__player_names is None:
+            self.__player_index = PlayerIndex(self.__batter_stats.index)
+        else:
+            self.__player_index = PlayerIndex(self.__player_names)
+
+    # Purpose: Gets the derived stats (see DerivedStats), with their order and
+    #          team indexes. They are computed when first used, and kept
+    #          until the batters' stats or the derived stats' definitions
+    #          change.
+    # Arguments: None.
+    # Returns: A tuple: the derived stats' DataFrame, StatOrderIndex and
+    #          TeamIndex.
+    def __get_derived(self):
+        derived = self.__derived
+        if derived is None:
+            with self.__lock:
+                if self.__derived is None:
+                    names = self.__derived_stats.get_names()
+                    values = self.__derived_stats.compute(self.__batter_stats)
+                    frame = pd.concat([self.__batter_stats[['POS', 'Team']], \
+                                       values], axis = 1)
+                    stat_order = StatOrderIndex(frame, names, \
+                                                compact = self.__compact)
+                    self.__derived = (values, stat_order, \
+                                      TeamIndex(frame, names, stat_order))
+                derived = self.__derived
+        return derived
+
+    # Purpose: Gets the table and indexes that hold a stat, base or derived.
+    # Arguments: A string: the stat.
+    # Returns: A tuple: the DataFrame, StatOrderIndex and TeamIndex.
+    def __get_source(self, stat):
+        if stat in STATS:
+            return self.__batter_stats, self.__stat_order, self.__team_index
+        if stat in self.__derived_stats.get_names():
+            return self.__get_derived()
+        raise KeyError(stat)
+
+    # Purpose: Gets every player's percentile in every stat. They are
+    #          computed on the first request after the batters' stats change.
+    # Arguments: None.
+    # Returns: A DataFrame: one row per player and one column per stat.
+    def __get_percentiles(self):
+        # A player's percentile in a stat is the position of the first player
+        # with the same score in the stat's sorted order, i.e. one plus the
+        # number of players with a lower score, over the number of players.
+        stat_percentiles = self.__stat_percentiles
+        if stat_percentiles is None:
+            with self.__lock:
+                if self.__stat_percentiles is None:
+                    num_players = float(len(self.__batter_stats))
+                    percentiles = dict((stat, np.round(100 * \
+                                        self.__stat_order.get_min_ranks(\
+                                        stat) / num_players, 1)) for stat \
+                                       in STATS)
+                    if self.__player_names is None:
+                        index = self.__batter_stats.index
+                    else:
+                        index = pd.Index(self.__player_names, \
+                                         name = 'PLAYER')
+                    self.__stat_percentiles = pd.DataFrame(percentiles, \
+                                                           index = index)
+                stat_percentiles = self.__stat_percentiles
+        return stat_percentiles
+
+    # Purpose: Gets rows of the batters' stats, indexed by player name (in
+    #          the compact layout, the names are looked up in the side
+    #          table).
+    # Arguments: An int or a list of ints: the row positions. A string: a
+    #            stat (None gets every column).
+    # Returns: A Series or DataFrame: the rows (a Series named after the
+    #          player for a single row of every column).
+    def __get_rows(self, positions, stat = None):
+        if stat is None:
+            rows = self.__batter_stats.iloc[positions]
+        else:
+            rows = self.__get_source(stat)[0][stat].iloc[positions]
+        if self.__player_names is None:
+            return rows
+        if stat is None and np.ndim(positions) == 0:
+            rows.name = self.__player_names[positions]
+        else:
+            rows.index = pd.Index(self.__player_names[positions], \
+                                  name = 'PLAYER')
+        return rows
+
+    # Purpose: Gets the memory used by each column of the batters' stats,
+    #          the index, (in the compact layout) the player name table, and
+    #          the indexes kept next to them: the stat order, team and player
+    #          indexes, and the derived stats and similarity index once
+    #          they are built.
+    # Arguments: None.
+    # Returns: A DataFrame: each column's and index's dtype and bytes, with a
+    #          total row.
+    def get_memory_usage(self):
+        usage = self.__batter_stats.memory_usage(deep = True)
+        dtypes = [str(self.__batter_stats.index.dtype)] + \
+                 [str(self.__batter_stats[column].dtype) for column in \
+                  self.__batter_stats.columns]
+        report = pd.DataFrame({'Dtype': dtypes, 'Bytes': usage.to_numpy()}, \
+                              index = usage.index)
+        if self.__player_names is not None:
+            names = pd.Series(self.__player_names)
+            report.loc['Player names'] = ['object', \
+                                          names.memory_usage(deep = True, \
+                                                             index = False)]
+        report.loc['Stat order index'] = ['index', \
+                                          self.__stat_order.get_memory_usage()]
+        report.loc['Team index'] = ['index', \
+                                    self.__team_index.get_memory_usage()]
+        report.loc['Player index'] = ['index', \
+                                      self.__player_index.get_memory_usage()]
+        derived = self.__derived
+        if derived is not None:
+            report.loc['Derived stats'] = ['index', \
+                                           int(derived[0].memory_usage(\
+                                           deep = True).sum()) + \
+                                           derived[1].get_memory_usage() + \
+                                           derived[2].get_memory_usage()]
+        similarity = self.__similarity
+        if similarity is not None:
+            report.loc['Similarity index'] = ['index', \
+                                              similarity.get_memory_usage()]
+        report.loc['Total'] = ['', report['Bytes'].sum()]
+        return report
+
     # Purpose: Checks if a string is a valid stat.
     # Arguments: A string: the stat to be verified.
     # Returns: A boolean: True if the stat passed to the function is a valid
     #          stat and False if otherwise.
     def is_in_stats(self, stat):
-        stats = ['G', 'AB', 'R', 'H', '2B', '3B', 'HR', 'RBI', 'BB', 'K', \
-                 'SB', 'CS', 'AVG', 'SLG', 'OBP', 'OPS']
-        return stat in stats
+        return stat in STATS or stat in self.__derived_stats.get_names()
+
+    # Purpose: Gets a stat's name as it is stored, ignoring case (e.g. 'woba'
+    #          is 'wOBA').
+    # Arguments: A string: the stat.
+    # Returns: A string: the stat's name, or None if there is no such stat.
+    def get_stat_name(self, stat):
+        stat = str(stat).upper()
+        for name in self.get_stats():
+            if name.upper() == stat:
+                return name
+        return None
+
+    # Purpose: Gets every stat: the base stats and then the derived stats.
+    # Arguments: None.
+    # Returns: A list of strings: the stats.
+    def get_stats(self):
+        return STATS + self.__derived_stats.get_names()
+
+    # Purpose: Gets the derived stats' definitions.
+    # Arguments: None.
+    # Returns: A dictionary: each derived stat with its expression.
+    def get_derived_definitions(self):
+        return collections.OrderedDict((name, \
+               self.__derived_stats.get_expression(name)) for name in \
+               self.__derived_stats.get_names())
+
+    # Purpose: Adds (or redefines) a derived stat, so it can be used wherever
+    #          a stat can. See DERIVED_STATS for the expressions.
+    # Arguments: A string: the name. A string: the expression.
+    # Returns: Nothing.
+    def add_derived_stat(self, name, expression):
+        self.__derived_stats.add(name, expression)
+        self.__derived = None
+
+    # Purpose: Removes a derived stat (the derived stats that use it must be
+    #          removed first).
+    # Arguments: A string: the derived stat.
+    # Returns: Nothing.
+    def remove_derived_stat(self, name):
+        self.__derived_stats.remove(name)
+        self.__derived = None
+
+    # Purpose: Gets every player's derived stats.
+    # Arguments: None.
+    # Returns: A DataFrame: the players and their derived stats.
+    def get_derived_stats(self):
+        derived = self.__get_derived()[0].copy()
+        if self.__player_names is not None:
+            derived.index = pd.Index(self.__player_names, name = 'PLAYER')
+        return derived
 
     # Purpose: Converts a baseball team's name to the team name's abbreviation.
     # Arguments: A string: the team name.
     # Returns: A string: the team name's abbreviation.
     def name_to_abbrev(self, team):
         team = team.lower()
-        team_abbreviations = {"arizona diamondbacks": "AZ", \
-                              "atlanta braves": "ATL", \
-                              "baltimore orioles": "BAL", \
-                              "boston red sox": "BOS", \
-                              "chicago cubs": "CHC", \
-                              "chicago white sox": "CHW", \
-                              "cincinnati reds": "CIN", \
-                              "cleveland indians": "CLE", \
-                              "colorado rockies": "COL", \
-                              "detroit tigers": "DET", \
-                              "miami marlins": "MIA", \
-                              "houston astros": "HOU", \
-                              "kansas city royals": "KC", \
-                              "los angeles angels": "LAA",
-                              "los angeles dodgers": "LAD", \
-                              "milwaukee brewers": "MIL", \
-                              "minnesota twins": "MIN", \
-                              "new york yankees": "NYY", \
-                              "new york mets": "NYM", \
-                              "oakland athletics": "OAK", \
-                              "philadelphia phillies": "PHI", \
-                              "pittsburgh pirates": "PIT", \
-                              "san diego padres": "SD", \
-                              "san francisco giants": "SF", \
-                              "seattle mariners": "SEA", \
-                              "st. louis cardinals": "STL", \
-                              "tampa bay rays": "TB", \
-                              "texas rangers": "TEX", \
-                              "toronto blue jays": "TOR", \
-                              "washington nationals": "WSH"}
-        return team_abbreviations[team]
-
-    # Purpose: Gets the 2016 MLB standings.
-    # Arguments: None.
-    # Returns: A DataFrame: the 2016 MLB standings.
+        return TEAM_ABBREVIATIONS[team]
+
+    # Purpose: Gets where the batters' stats were loaded from and how long
+    #          the load took.
+    # Arguments: None.
+    # Returns: A tuple: the source ('cache' or 'excel') and the load time in
+    #          seconds.
+    def get_load_time(self):
+        return self.__load_source, self.__load_time
+
+    # Purpose: Gets the MLB standings: computed from the game results if
+    #          they were loaded (see load_game_results), and otherwise the
+    #          2016 final standings.
+    # Arguments: None.
+    # Returns: A DataFrame: the MLB standings. Raises a KeyError if the
+    #          season was given (by the caller or a season store) and isn't
+    #          2016, and no game results were loaded.
     def get_standings(self):
+        if self.__standings is not None:
+            return self.__standings.get_table()
+        if self.__season_given and self.__season != 2016:
+            raise KeyError("No standings for season %d" % self.__season)
         return self.__standings_frame
 
+    # Purpose: Loads game results, from which the standings and playoff odds
+    #          are computed.
+    # Arguments: A string: the path to the game results (see
+    #            read_game_results).
+    # Returns: Nothing.
+    def load_game_results(self, path):
+        self.__standings = Standings(read_game_results(path))
+
+    # Purpose: Gets the standings within each division, with games back.
+    # Arguments: None.
+    # Returns: A DataFrame: the standings, indexed by division and rank.
+    #          Raises a ValueError if no game results were loaded.
+    def get_division_standings(self):
+        if self.__standings is None:
+            raise ValueError("No game results loaded")
+        return self.__standings.get_table(True)
+
+    # Purpose: Estimates the playoff odds by simulating the rest of the
+    #          season (see Standings.get_playoff_odds).
+    # Arguments: An int: the number of simulated seasons. An int: the random
+    #            seed (None for a random one). An int: the number of
+    #            processes (defaults to the number of CPUs).
+    # Returns: A DataFrame: each team's playoff odds. Raises a ValueError if
+    #          no game results were loaded or the number of simulations is
+    #          less than 1.
+    def get_playoff_odds(self, num_simulations = 100000, seed = None, \
+                         processes = None):
+        if self.__standings is None:
+            raise ValueError("No game results loaded")
+        return self.__standings.get_playoff_odds(num_simulations, seed, \
+                                                 processes)
+
+    # Purpose: Gets the season store, creating a one-season store for a
+    #          single workbook.
+    # Arguments: None.
+    # Returns: A SeasonStore: the store.
+    def __get_store(self):
+        if self.__store is None:
+            self.__store = SeasonStore(self.__stats_file, self.__use_cache, \
+                                       self.__compact)
+            self.__store.add_resident(self.__season, self)
+        return self.__store
+
+    # Purpose: Gets the seasons that can be queried.
+    # Arguments: None.
+    # Returns: A list of ints: the seasons, sorted.
+    def get_seasons(self):
+        return self.__get_store().get_seasons()
+
+    # Purpose: Gets the season this object holds.
+    # Arguments: None.
+    # Returns: An int: the season (None if the workbook's name has no year).
+    def get_season(self):
+        return self.__season
+
+    # Purpose: Gets a season's data, loading the season if it is not already
+    #          loaded. Only a few seasons are kept loaded at once.
+    # Arguments: An int: the season.
+    # Returns: A BaseballAnalytics: the season's data.
+    def load_season(self, season):
+        if season == self.__season:
+            return self
+        return self.__get_store().get_season(season)
+
+    # Purpose: Checks and sorts a list of seasons.
+    # Arguments: A list of ints: the seasons (None for every season).
+    # Returns: A list of ints: the seasons, sorted.
+    def __select_seasons(self, seasons):
+        available = self.get_seasons()
+        if seasons is None:
+            return available
+        seasons = sorted(set(seasons))
+        for season in seasons:
+            if season not in available:
+                raise KeyError("No workbook for season %s" % (season,))
+        return seasons
+
+    # Purpose: Gets a player's rows of this season's batters' stats.
+    # Arguments: A string: the player's name ("Last, First").
+    # Returns: A list of Series: the rows' team and stats.
+    def __get_player_lines(self, playern):
+        return [self.__batter_stats.iloc[position][['Team'] + STATS] for \
+                position in self.__player_index.get_ids(playern)]
+
+    # Purpose: Gets some base stats of this season's batters' stats.
+    # Arguments: A list of strings: the stats.
+    # Returns: A DataFrame: the stats, indexed by player name.
+    def __get_stat_columns(self, stats):
+        return pd.DataFrame(dict((stat, self.__batter_stats[stat].to_numpy()) \
+                                 for stat in stats), \
+                            index = pd.Index(self.__get_names(slice(None)), \
+                                             name = 'PLAYER'))
+
+    # Purpose: Gets a player's stats for each season and for their career.
+    #          Loaded seasons (this one included) use their stats in memory,
+    #          which may have been updated; for the other seasons, only the
+    #          names and the needed columns are read.
+    # Arguments: Two strings: the player's last and first name. A list of
+    #            ints: the seasons (None for every season).
+    # Returns: A DataFrame: one row per season the player played in, plus a
+    #          'Career' row. Raises a KeyError if the player played in none
+    #          of the seasons.
+    def get_career_stats(self, lastn, firstn, seasons = None):
+        playern = lastn + ", " + firstn
+        store = self.__get_store()
+        rows = []
+        labels = []
+        for season in self.__select_seasons(seasons):
+            ba = self if season == self.__season else \
+                 store.get_loaded(season)
+            if ba is not None:
+                lines = ba.__get_player_lines(playern)
+            else:
+                positions = store.get_player_rows(season, playern)
+                if not positions:
+                    continue
+                columns = store.get_columns(season, ['Team'] + STATS)
+                lines = [columns.iloc[position] for position in positions]
+            rows.extend(lines)
+            labels.extend([season] * len(lines))
+        if not rows:
+            raise KeyError(playern)
+        career = pd.DataFrame(rows)
+        career.index = pd.Index(labels, name = 'Season')
+        total = combine_batting_lines(career)
+        total['Team'] = ''
+        career.loc['Career'] = total[career.columns]
+        return career
+
+    # Purpose: Gets the players, across seasons, in the specified percentile
+    #          or in a percentile that is greater than the specified
+    #          percentile of the specified stat. Loaded seasons (this one
+    #          included) use their stats in memory, which may have been
+    #          updated; for the other seasons, only the columns the stat
+    #          needs are read. A derived stat is computed from each season's
+    #          base stats with this object's definitions.
+    # Arguments: A string: the stat. A float: the quantile. A list of ints:
+    #            the seasons (None for every season).
+    # Returns: A Series: the players' scores, indexed by season and player,
+    #          sorted by ascending score. Raises a KeyError if the stat is
+    #          unknown.
+    def get_multi_season_quantile_stat(self, stat, quantile, seasons = None):
+        if stat not in self.get_stats():
+            raise KeyError(stat)
+        derived = stat not in STATS
+        needed = STATS if derived else [stat]
+        store = self.__get_store()
+        columns = []
+        for season in self.__select_seasons(seasons):
+            ba = self if season == self.__season else \
+                 store.get_loaded(season)
+            if ba is not None:
+                frame = ba.__get_stat_columns(needed)
+            else:
+                frame = store.get_columns(season, needed)
+            if derived:
+                column = self.__derived_stats.compute(frame)[stat]
+            else:
+                column = frame[stat]
+            column.index = pd.MultiIndex.from_arrays(\
+                           [np.repeat(season, len(column)), column.index], \
+                           names = ['Season', 'PLAYER'])
+            columns.append(column)
+        scores = pd.concat(columns)
+        players = scores[scores >= scores.quantile(quantile)]
+        return players.sort_values(ascending = True, kind = 'mergesort')
+
+    # Purpose: Finds the rows of the players in a chunk of game lines. A name
+    #          shared by several players is matched by team. Players that
+    #          are not in the batters' stats yet are appended (with zeros).
+    # Arguments: A DataFrame: the game lines.
+    # Returns: A tuple: a numpy array of each line's row position and a
+    #          boolean: whether players were appended.
+    def __match_game_lines(self, lines):
+        names = lines['PLAYER'].astype(str).to_numpy(dtype = object)
+        if 'Team' in lines:
+            teams = lines['Team'].fillna('FA').astype(str)
+            teams = teams.to_numpy(dtype = object)
+        else:
+            teams = np.full(len(lines), 'FA', dtype = object)
+        codes, pairs = pd.factorize(names + '\t' + teams)
+        first_lines = np.unique(codes, return_index = True)[1]
+        team_column = self.__batter_stats['Team'].to_numpy()
+        targets = np.empty(len(pairs), dtype = np.intp)
+        added = {}
+        for i, pair in enumerate(pairs):
+            name, team = pair.split('\t')
+            ids = self.__player_index.get_ids(name)
+            if ids:
+                same_team = [player_id for player_id in ids if \
+                             team_column[player_id] == team]
+                targets[i] = (same_team or ids)[0]
+            else:
+                key = normalize_name(name)
+                if key not in added:
+                    added[key] = (len(team_column) + len(added), \
+                                  first_lines[i])
+                targets[i] = added[key][0]
+        if added:
+            first_lines = [line for position, line in sorted(added.values())]
+            self.__append_players(lines.iloc[first_lines], \
+                                  names[first_lines], teams[first_lines])
+        return targets[codes], bool(added)
+
+    # Purpose: Appends players, with zeros for every stat, to the batters'
+    #          stats. The indexes must be rebuilt afterwards.
+    # Arguments: A DataFrame: each player's first game line. A numpy array:
+    #            the players' names. A numpy array: the players' teams.
+    # Returns: Nothing.
+    def __append_players(self, lines, names, teams):
+        rows = {'POS': lines['POS'].fillna('').astype(str).to_numpy() if \
+                       'POS' in lines else np.full(len(lines), ''),
+                'Team': teams}
+        for stat in STATS:
+            rows[stat] = np.zeros(len(lines), dtype = np.int64 if stat in \
+                                  COUNTING_STATS else np.float64)
+        rows = pd.DataFrame(rows, index = pd.Index(names, name = 'PLAYER'))
+        if self.__player_names is None:
+            columns = self.__batter_stats.columns
+            self.__batter_stats = pd.concat([self.__batter_stats, \
+                                             rows[columns]])
+            return
+        batter_stats = self.__batter_stats.astype({'POS': object, \
+                                                   'Team': object})
+        batter_stats.index = pd.Index(self.__player_names, name = 'PLAYER')
+        self.__batter_stats, self.__player_names = \
+        compact_batter_stats(pd.concat([batter_stats, \
+                                        rows[batter_stats.columns]]))
+
+    # Purpose: Applies a chunk of game lines to the batters' stats. The
+    #          counting stats are added to, and the rate stats are recomputed
+    #          for the players in the chunk only (OBP is updated from its
+    #          previous value, since the batters' stats have no HBP or SF).
+    #          The order and team indexes are updated in place, unless new
+    #          players were appended, which rebuilds them.
+    # Arguments: A DataFrame: the game lines (see read_game_logs).
+    # Returns: A numpy array: the row positions of the players updated.
+    def apply_game_lines(self, lines):
+        if len(lines) == 0:
+            return np.array([], dtype = np.intp)
+        line_positions, added = self.__match_game_lines(lines)
+        counts = []
+        for stat in GAME_LOG_STATS:
+            if stat in lines:
+                counts.append(pd.to_numeric(lines[stat]).fillna(int(stat == \
+                              'G')).to_numpy(dtype = np.int64))
+            else:
+                counts.append(np.full(len(lines), int(stat == 'G'), \
+                                      dtype = np.int64))
+        positions, inverse = np.unique(line_positions, return_inverse = True)
+        deltas = np.zeros((len(positions), len(GAME_LOG_STATS)), \
+                          dtype = np.int64)
+        np.add.at(deltas, inverse, np.column_stack(counts))
+        deltas = dict(zip(GAME_LOG_STATS, deltas.T))
+        frame = self.__batter_stats
+        previous = np.column_stack([frame[stat].to_numpy()[positions] for \
+                                    stat in STATS]).astype(np.float64)
+        old = dict(zip(STATS, previous.T))
+        new = {}
+        for stat in COUNTING_STATS:
+            # Copy the column (the cached columns are read-only memory maps),
+            # widening a compact column if the new totals don't fit in it.
+            column = frame[stat].to_numpy()
+            values = column[positions].astype(np.int64) + deltas[stat]
+            column = column.astype(np.result_type(column.dtype, \
+                                   np.min_scalar_type(values.min()), \
+                                   np.min_scalar_type(values.max())))
+            column[positions] = values
+            frame[stat] = column
+            new[stat] = values.astype(np.float64)
+        total_bases = new['H'] + new['2B'] + 2 * new['3B'] + 3 * new['HR']
+        reached = old['OBP'] * (old['AB'] + old['BB']) + deltas['H'] + \
+                  deltas['BB'] + deltas['HBP']
+        chances = old['AB'] + old['BB'] + deltas['AB'] + deltas['BB'] + \
+                  deltas['HBP'] + deltas['SF']
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            rates = {'AVG': np.where(new['AB'] > 0, new['H'] / new['AB'], \
+                                     0.0),
+                     'SLG': np.where(new['AB'] > 0, total_bases / new['AB'], \
+                                     0.0),
+                     'OBP': np.where(chances > 0, reached / chances, 0.0)}
+        rates['OPS'] = rates['OBP'] + rates['SLG']
+        for stat, values in rates.items():
+            column = frame[stat].to_numpy().copy()
+            column[positions] = values
+            frame[stat] = column
+        if added:
+            self.__build_indexes()
+        else:
+            self.__stat_order.update(frame, positions)
+            self.__team_index.update(positions, previous)
+            self.__stat_percentiles = None
+            self.__derived = None
+            self.__similarity = None
+        return positions
+
+    # Purpose: Streams a game log (see read_game_logs) into the batters'
+    #          stats, one chunk at a time. Only the loaded stats change; the
+    #          workbook and its cache are left as they are.
+    # Arguments: A string: the game log's path. An int: the number of lines
+    #            per chunk.
+    # Returns: A tuple: the number of game lines and of players updated.
+    def ingest_game_logs(self, path, chunk_size = 10000):
+        num_lines = 0
+        players = set()
+        for lines in read_game_logs(path, chunk_size):
+            players.update(self.apply_game_lines(lines).tolist())
+            num_lines += len(lines)
+        return num_lines, len(players)
+
     # Purpose: Gets a specified 2016 MLB roster.
     # Arguments: A string: the team name's abbreviation
     # Returns: A DataFrame: the players on the team
     def get_team_roster(self, team_abbrev):
-        return self.__batter_stats[self.__batter_stats['Team'] == team_abbrev]
+        return self.__get_rows(self.__team_index.get_rows(team_abbrev))
 
     # Purpose: Gets a specified 2016 MLB player's season stats.
     # Arguments: Two string: the player's first and last name.
     # Returns: A DataFrame: the specified MLB player's season stats.
     def get_player_stats(self, lastn, firstn):
-        playern = lastn + ", " + firstn
-        playern = playern.title()
-        return self.__batter_stats.ix[playern]
+        player_ids = self.__get_player_ids(lastn + ", " + firstn)
+        if len(player_ids) == 1:
+            return self.__get_rows(player_ids[0])
+        return self.__get_rows(player_ids)
+
+    # Purpose: Gets the ids of the players with the specified name.
+    # Arguments: A string: the player's name ("Last, First"), in any case and
+    #            with or without accents and punctuation.
+    # Returns: A list of ints: the player ids. Raises a KeyError if there is
+    #          no such player.
+    def __get_player_ids(self, playern):
+        player_ids = self.__player_index.get_ids(playern)
+        if not player_ids:
+            raise KeyError(playern)
+        return player_ids
+
+    # Purpose: Gets the ids of the players with the specified name. Players
+    #          who share a name have different ids.
+    # Arguments: Two strings: the player's last and first name.
+    # Returns: A list of ints: the player ids (empty if there is no such
+    #          player).
+    def get_player_ids(self, lastn, firstn):
+        return list(self.__player_index.get_ids(lastn + ", " + firstn))
+
+    # Purpose: Gets a player's season stats by player id.
+    # Arguments: An int: the player id.
+    # Returns: A Series: the player's season stats.
+    def get_player_stats_by_id(self, player_id):
+        return self.__get_rows(player_id)
+
+    # Purpose: Finds the players whose names start with the specified prefix,
+    #          for autocompletion. "Last, First" and "First Last" are both
+    #          matched.
+    # Arguments: A string: the prefix. An int: the maximum number of players.
+    # Returns: A Series: the players' names, indexed by player id.
+    def find_players(self, prefix, limit = 10):
+        player_ids = self.__player_index.find_prefix(prefix, limit)
+        return pd.Series([self.__player_index.get_name(player_id) for \
+                          player_id in player_ids], index = player_ids, \
+                         name = 'PLAYER', dtype = object)
+
+    # Purpose: Finds the players whose names are most similar to the
+    #          specified name, e.g. to correct misspellings.
+    # Arguments: A string: the name. An int: the number of players. A float:
+    #            the minimum similarity (between 0 and 1).
+    # Returns: A DataFrame: each player's name and similarity, indexed by
+    #          player id, most similar first.
+    def search_players(self, name, k = 10, min_score = 0.0):
+        matches = self.__player_index.find_similar(name, k, min_score)
+        return pd.DataFrame({'PLAYER': [self.__player_index.get_name(\
+                                        player_id) for player_id, score in \
+                                        matches],
+                             'Score': [score for player_id, score in \
+                                       matches]},
+                            index = [player_id for player_id, score in \
+                                     matches])
+
+    # Purpose: Joins a list of player names against the batters. Each name is
+    #          matched exactly (after normalization); names without an exact
+    #          match can fall back to their most similar player.
+    # Arguments: A list of strings: the names ("Last, First"). A float: the
+    #            minimum similarity of a fallback match (None for exact
+    #            matches only).
+    # Returns: A DataFrame: one row per match (a name shared by several
+    #          players matches each of them), with the name, the player id
+    #          (-1 if unmatched), the matched player's name and the match's
+    #          similarity.
+    def match_players(self, names, min_score = None):
+        rows = []
+        for name in names:
+            player_ids = self.__player_index.get_ids(name)
+            matches = [(player_id, 1.0) for player_id in player_ids]
+            if not matches and min_score is not None:
+                matches = self.__player_index.find_similar(name, 1, min_score)
+            if not matches:
+                rows.append((name, -1, None, 0.0))
+            for player_id, score in matches:
+                rows.append((name, player_id, \
+                             self.__player_index.get_name(player_id), score))
+        return pd.DataFrame(rows, columns = ['Name', 'Player_Id', 'PLAYER', \
+                                             'Score'])
+
+    # Purpose: Gets an aggregate of each team's stats, base or derived.
+    # Arguments: A string: the aggregate ('mean', 'median', 'std' or 'sum').
+    #            A list of strings: the stats (defaults to the base stats).
+    # Returns: A DataFrame: the aggregate of each team's stats.
+    def __get_team_aggregate(self, name, stats):
+        if stats is None:
+            return self.__team_index.get_aggregate(name)
+        return pd.concat([self.__get_source(stat)[2].get_aggregate(name)\
+                          [stat] for stat in stats], axis = 1)
+
+    # Purpose: Gets the similarity index over the base stats. It is built
+    #          when first used, and again after the batters' stats change.
+    # Arguments: None.
+    # Returns: A SimilarityIndex: the index.
+    def __get_similarity(self):
+        similarity = self.__similarity
+        if similarity is None:
+            with self.__lock:
+                if self.__similarity is None:
+                    self.__similarity = SimilarityIndex(self.__batter_stats)
+                similarity = self.__similarity
+        return similarity
+
+    # Purpose: Gets the player names at row positions.
+    # Arguments: A numpy array: the row positions.
+    # Returns: A numpy array of strings: the names.
+    def __get_names(self, positions):
+        if self.__player_names is None:
+            return self.__batter_stats.index.to_numpy()[positions]
+        return self.__player_names[positions]
+
+    # Purpose: Gets the k players whose stats are most like the specified
+    #          player's (see SimilarityIndex.nearest). Each stat is
+    #          standardized, so it counts alike unless weighted.
+    # Arguments: Two strings: the player's last and first name. An int: k.
+    #            An int: the fewest at bats a similar player can have. A
+    #            dictionary: each stat with its weight (1 if not given).
+    # Returns: A Series: the similar players and their distances from the
+    #          specified player, nearest first.
+    def get_similar_players(self, lastn, firstn, k = 10, min_ab = 0, \
+                            weights = None):
+        player_id = self.__get_player_ids(lastn + ", " + firstn)[0]
+        neighbors, distances = self.__get_similarity().nearest(\
+                               [player_id], k, weights, min_ab)
+        found = neighbors[0] >= 0
+        return pd.Series(distances[0][found], \
+                         index = pd.Index(self.__get_names(\
+                                          neighbors[0][found]), \
+                                          name = 'PLAYER'), \
+                         name = 'Distance')
+
+    # Purpose: Gets every player's k most similar players (see
+    #          get_similar_players), computed in blocks that fit the memory
+    #          budget.
+    # Arguments: An int: k. An int: the fewest at bats a player can have
+    #            (players with fewer are neither searched nor found). A
+    #            dictionary: each stat with its weight. An int: the memory
+    #            budget (in bytes) for a block's distances.
+    # Returns: A DataFrame: a row per player and neighbor, with the player,
+    #          the neighbor's rank, the neighbor and the distance.
+    def get_all_similar_players(self, k = 5, min_ab = 0, weights = None, \
+                                memory_budget = SIMILARITY_MEMORY):
+        rows, neighbors, distances = self.__get_similarity().all_nearest(\
+                                     k, weights, min_ab, memory_budget)
+        found = neighbors >= 0
+        return pd.DataFrame({'PLAYER': self.__get_names(np.repeat(rows, \
+                                       found.sum(axis = 1))),
+                             'Rank': np.nonzero(found)[1] + 1,
+                             'Similar': self.__get_names(neighbors[found]),
+                             'Distance': distances[found]})
 
     # Purpose: For each 2016 MLB team, this function averages the players'
     #          stats.
-    # Arguments: None.
+    # Arguments: A list of strings: the stats, base or derived (defaults to
+    #            the base stats).
     # Returns: A DataFrame: The means of each team's stats.
-    def get_avg_team_stats(self):
-        no_fas = self.__batter_stats[self.__batter_stats['Team'] != 'FA']
-        return no_fas.groupby(no_fas['Team']).mean().round(3)
+    def get_avg_team_stats(self, stats = None):
+        return self.__get_team_aggregate('mean', stats).round(3)
 
     # Purpose: For each 2016 MLB team, this function takes the median of the
     #          players' stats.
-    # Arguments: None.
+    # Arguments: A list of strings: the stats, base or derived (defaults to
+    #            the base stats).
     # Returns: A DataFrame: The medians of each team's stats.
-    def get_med_team_stats(self):
-        no_fas = self.__batter_stats[self.__batter_stats['Team'] != 'FA']
-        return no_fas.groupby(no_fas['Team']).median()
+    def get_med_team_stats(self, stats = None):
+        return self.__get_team_aggregate('median', stats).copy()
 
     # Purpose: For each 2016 MLB team, this function takes the standard
     #          deviation of the players' stats.
-    # Arguments: None.
+    # Arguments: A list of strings: the stats, base or derived (defaults to
+    #            the base stats).
     # Returns: A DataFrame: The standard deviations of each team's stats.
-    def get_std_team_stats(self):
-        no_fas = self.__batter_stats[self.__batter_stats['Team'] != 'FA']
-        return no_fas.groupby(no_fas['Team']).std().round(3)
+    def get_std_team_stats(self, stats = None):
+        return self.__get_team_aggregate('std', stats).round(3)
 
     # Purpose: Gets the mean of the specified stat for all 2016 MLB players.
     # Arguments: A string: the stat.
     # Returns: A float: the mean.
     def get_mean_stat(self, stat):
-        return round(self.__batter_stats[stat].mean(), 3)
+        return round(np.float64(self.__get_source(stat)[0][stat].mean()), \
+                     3)
 
     # Purpose: Gets the median of the specified stat for all 2016 MLB players.
     # Arguments: A string: the stat.
     # Returns: A float: the median.
     def get_median_stat(self, stat):
-        return self.__batter_stats[stat].median()
+        return np.float64(self.__get_source(stat)[0][stat].median())
 
     # Purpose: Gets the standard deviation of the specified stat for all
     #          2016 MLB players.
     # Arguments: A string: the stat.
     # Returns: A float: the standard deviation.
     def get_std_stat(self, stat):
-        return round(self.__batter_stats[stat].std(), 3)
+        return round(np.float64(self.__get_source(stat)[0][stat].std()), 3)
+
+    # Purpose: Gets a bootstrap confidence interval for the mean, median or
+    #          standard deviation of the specified stat for all 2016 MLB
+    #          players (see bootstrap_intervals).
+    # Arguments: A string: the stat. A string: the summary ('mean', 'median'
+    #            or 'std'). An int: the number of resamples. A float: the
+    #            confidence level. An int: the random seed (None for a random
+    #            one). An int: the number of processes.
+    # Returns: A Series: the summary's estimate and the interval's lower and
+    #          upper bounds.
+    def get_stat_interval(self, stat, summary = 'mean', \
+                          num_resamples = 10000, confidence = 0.95, \
+                          seed = None, processes = None):
+        values = self.__get_source(stat)[0][stat].to_numpy(dtype = \
+                                                           np.float64)
+        estimates, lower, upper = bootstrap_intervals(\
+                                  values[np.newaxis], [0, len(values)], \
+                                  summary, num_resamples, confidence, seed, \
+                                  processes)
+        return pd.Series([estimates[0, 0], lower[0, 0], upper[0, 0]], \
+                         index = ['Estimate', 'Lower', 'Upper'], name = stat)
+
+    # Purpose: Gets bootstrap confidence intervals for the mean, median or
+    #          standard deviation of each 2016 MLB team's stats (not
+    #          including free agents). Each team's players are resampled
+    #          (see bootstrap_intervals), so teams with few players get wide
+    #          intervals.
+    # Arguments: A string: the summary ('mean', 'median' or 'std'). An int:
+    #            the number of resamples. A float: the confidence level. An
+    #            int: the random seed (None for a random one). An int: the
+    #            number of processes. A list of strings: the stats, base or
+    #            derived (defaults to the base stats).
+    # Returns: A DataFrame: for each team and stat, the summary's estimate
+    #          and the interval's lower and upper bounds.
+    def get_team_stat_intervals(self, summary = 'mean', \
+                                num_resamples = 10000, confidence = 0.95, \
+                                seed = None, processes = None, stats = None):
+        if stats is None:
+            stats = STATS
+        teams = [team for team in self.__team_index.get_teams() if \
+                 team != 'FA']
+        rows = [self.__team_index.get_rows(team) for team in teams]
+        bounds = np.concatenate([[0], np.cumsum([len(team_rows) for \
+                                                 team_rows in rows])])
+        rows = np.concatenate(rows)
+        values = np.vstack([self.__get_source(stat)[0][stat].to_numpy(\
+                            dtype = np.float64)[rows] for stat in stats])
+        estimates, lower, upper = bootstrap_intervals(values, bounds, \
+                                  summary, num_resamples, confidence, seed, \
+                                  processes)
+        return pd.DataFrame({'Estimate': estimates.ravel(),
+                             'Lower': lower.ravel(),
+                             'Upper': upper.ravel()},
+                            index = pd.MultiIndex.from_product(\
+                                    [teams, list(stats)], \
+                                    names = ['Team', 'Stat']))
 
     # Purpose: Gets the player with the max score for the specified stat.
     # Arguments: A string: the stat.
     # Returns: A Series: The name of the player with the player's corresponding
     #          score for the specified stat.
     def get_max_stat_player(self, stat):
-        return self.__batter_stats[self.__batter_stats[stat] == \
-                                   self.__batter_stats[stat].max()][stat]
+        return self.__get_rows(self.__get_source(stat)[1].top_k(stat, 1), \
+                               stat)
 
     # Purpose: Gets the players in the 2016 MLB in the specified percentile
     #          or in a percentile that is greater than the specified percentile
@@ -193,59 +2756,153 @@ class BaseballAnalytics(object):
     # Returns: A Series: the players and their corresponding
     #          scores for the specified stat.
     def get_quantile_stat(self, stat, quantile):
-        players = self.__batter_stats[self.__batter_stats[stat] >= \
-                  self.__batter_stats[stat].quantile(quantile)]
-        return players[stat].sort_values(ascending = True)
+        stat_order = self.__get_source(stat)[1]
+        return self.__get_rows(stat_order.at_or_above(stat, quantile), stat)
+
+    # Purpose: Gets the k players with the highest scores in the specified
+    #          stat, optionally restricted to one team or position. Players
+    #          tied with the k-th score are all included.
+    # Arguments: A string: the stat. An int: k. A string: the team's
+    #            abbreviation. A string: the position.
+    # Returns: A Series: the players and their corresponding scores for the
+    #          specified stat, sorted by descending score.
+    def get_top_players(self, stat, k, team_abbrev = None, pos = None):
+        frame, stat_order = self.__get_source(stat)[:2]
+        if team_abbrev is not None and pos is not None:
+            # Rank the whole team, then keep the position's top k.
+            positions = stat_order.top_k(stat, len(self.__batter_stats), \
+                                         'Team', team_abbrev)
+            positions = positions[self.__batter_stats['POS'].to_numpy()\
+                                  [positions] == pos]
+            if k <= 0:
+                positions = positions[:0]
+            elif k < len(positions):
+                scores = frame[stat].to_numpy()[positions]
+                positions = positions[scores >= scores[k - 1]]
+        elif team_abbrev is not None:
+            positions = stat_order.top_k(stat, k, 'Team', team_abbrev)
+        elif pos is not None:
+            positions = stat_order.top_k(stat, k, 'POS', pos)
+        else:
+            positions = stat_order.top_k(stat, k)
+        return self.__get_rows(positions, stat)
+
+    # Purpose: Gets the players whose score in the specified stat is between
+    #          the two specified scores (inclusive).
+    # Arguments: A string: the stat. Two floats: the low and high scores.
+    # Returns: A Series: the players and their corresponding scores for the
+    #          specified stat, sorted by ascending score.
+    def get_range_stat(self, stat, low, high):
+        stat_order = self.__get_source(stat)[1]
+        return self.__get_rows(stat_order.between(stat, low, high), stat)
 
     # Purpose: Gets the specified MLB player's percentile for each stat.
     # Arguments: Two strings: the player's first and last name.
     # Returns: A dictionary of each stat with its corresponding percentile.
     def get_player_quantile(self, lastn, firstn):
-        lastn = lastn.capitalize()
-        firstn = firstn.capitalize()
-        original_playern = lastn + ", " + firstn
-        num_players = float(len(self.__batter_stats))
-        quantiles = {'G': '',
-                     'AB': '',
-                     'R': '',
-                     'H': '',
-                     '2B': '',
-                     '3B': '',
-                     'HR': '',
-                     'RBI': '',
-                     'BB': '',
-                     'K': '',
-                     'SB': '',
-                     'CS': '',
-                     'AVG': '',
-                     'SLG': '',
-                     'OBP': '',
-                     'OPS': ''}
-        for stat in quantiles.keys():
-            players_by_stat = self.__batter_stats.sort_values(by=stat)
-            playern = players_by_stat[players_by_stat[stat] ==
-                                      self.__batter_stats.ix[original_playern, \
-                                                      stat]].ix[0].name
-            quantiles[stat] = str(round((100 * int(\
-                                         players_by_stat.index.get_loc(playern)\
-                                         + 1) / num_players), 1)) + '%'
-        print("Name: " + original_playern)
-        for stat in quantiles.keys():
-            print(stat + ': ' + quantiles[stat])
+        player_ids = self.__get_player_ids(lastn + ", " + firstn)
+        return dict(self.__get_percentiles().iloc[player_ids[0]])
+
+    # Purpose: Gets the percentile of each stat for the specified players, or
+    #          for every player if no players are specified.
+    # Arguments: A list of strings: the players' names ("Last, First").
+    # Returns: A DataFrame: one row per player and one column per stat.
+    def get_player_percentiles(self, players = None):
+        if players is None:
+            return self.__get_percentiles().copy()
+        player_ids = []
+        for player in players:
+            player_ids.extend(self.__get_player_ids(player))
+        return self.__get_percentiles().iloc[player_ids]
+
+    # Purpose: Gets the data a chart needs, so the chart can be drawn without
+    #          this object (e.g. in another process).
+    # Arguments: A tuple: the chart spec, one of ('team-by-stat', stat),
+    #            ('stat-by-stat', stat1, stat2) or ('team-comparison',
+    #            team_abbrev1, team_abbrev2).
+    # Returns: A tuple: the chart's kind, labels and data.
+    def get_chart_payload(self, spec):
+        kind = spec[0]
+        if kind == 'team-by-stat':
+            stat = self.get_stat_name(spec[1])
+            team_sums = self.__get_source(stat)[2].get_aggregate('sum')[stat]
+            team_sums = team_sums.sort_values(ascending = True)
+            return (kind, stat, list(team_sums.index), team_sums.to_numpy())
+        elif kind == 'stat-by-stat':
+            stat1 = self.get_stat_name(spec[1])
+            stat2 = self.get_stat_name(spec[2])
+            return (kind, stat1, stat2, \
+                    self.__get_source(stat1)[0][stat1].to_numpy(), \
+                    self.__get_source(stat2)[0][stat2].to_numpy())
+        elif kind == 'team-comparison':
+            team_sums = self.__team_index.get_aggregate('sum', True)
+            team_sums = team_sums.drop(['CS', 'AVG', 'SLG', 'OBP', 'OPS'], \
+                                       axis = 1)
+            return (kind, spec[1], spec[2], list(team_sums.columns), \
+                    team_sums.loc[spec[1]].to_numpy(), \
+                    team_sums.loc[spec[2]].to_numpy())
+        raise ValueError("Invalid chart: %s" % (kind,))
+
+    # Purpose: Gets the specs of every chart of a kind: every stat by team,
+    #          every pair of stats, or every pair of teams (not including free
+    #          agents).
+    # Arguments: A string: the kind ('team-by-stat', 'stat-by-stat' or
+    #            'team-comparison').
+    # Returns: A list of tuples: the chart specs.
+    def get_chart_specs(self, kind):
+        if kind == 'team-by-stat':
+            return [(kind, stat) for stat in STATS]
+        elif kind == 'stat-by-stat':
+            return [(kind, stat1, stat2) for stat1 in STATS for stat2 in \
+                    STATS if stat1 != stat2]
+        elif kind == 'team-comparison':
+            teams = [team for team in self.__team_index.get_teams() if \
+                     team != 'FA']
+            return [(kind, team1, team2) for team1 in teams for team2 in \
+                    teams if team1 != team2]
+        raise ValueError("Invalid chart: %s" % (kind,))
+
+    # Purpose: Renders charts to image files without a display. Each chart is
+    #          drawn on its own Figure, and the charts are spread across a
+    #          process pool.
+    # Arguments: A list of tuples: the chart specs (see get_chart_payload). A
+    #            string: the output directory. A string: the image format
+    #            ('png' or 'svg'). An int: the number of processes (defaults
+    #            to the number of CPUs; 1 renders in this process).
+    # Returns: A list of strings: the paths of the rendered files.
+    def render_charts(self, specs, out_dir = 'charts', fmt = 'png', \
+                      processes = None):
+        if not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+        payloads = [self.get_chart_payload(spec) for spec in specs]
+        paths = [os.path.join(out_dir, "-".join(str(part) for part in \
+                                                spec) + "." + fmt) \
+                 for spec in specs]
+        if processes is None:
+            processes = os.cpu_count() or 1
+        if processes <= 1 or len(payloads) <= 1:
+            return [render_chart(payload, path) for payload, path in \
+                    zip(payloads, paths)]
+        chunksize = max(1, len(payloads) // (4 * processes))
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            return list(executor.map(render_chart, payloads, paths, \
+                                     chunksize = chunksize))
+
+    # Purpose: Shows a chart in a new pyplot window.
+    # Arguments: A tuple: the chart spec.
+    # Returns: Nothing.
+    def __show_chart(self, spec):
+        payload = self.get_chart_payload(spec)
+        import matplotlib.pyplot as plt
+        draw_chart(plt.figure(), payload)
+        plt.show()
 
     # Purpose: Creates a horizontal bar graph with each team on the y-axis
     #          and each team's total specified stat on the x-axis.
     # Arguments: A string: the specified stat.
     # Returns: Nothing.
     def graph_team_by_stat(self, stat):
-        stat = stat.upper()
-        no_fa = self.__batter_stats[self.__batter_stats['Team'] != 'FA']
-        grouped_by_teams = no_fa.groupby(no_fa['Team'])
-        grouped_by_teams[stat].sum().sort_values(ascending = True).plot.barh()
-        plt.xlabel(stat)
-        plt.ylabel('Team')
-        plt.title(("%s By Team") % (stat))
-        plt.show()
+        self.__show_chart(('team-by-stat', stat))
 
     # Purpose: Creates a scatter plot comparing two 2016 MLB stats. The first
     #          stat corresponds to the x-axis, and the second stat corresponds
@@ -253,48 +2910,912 @@ class BaseballAnalytics(object):
     # Arguments: Two strings: the two stats.
     # Returns: Nothing.
     def graph_stat_by_stat(self, stat1, stat2):
-        stat1 = stat1.upper()
-        stat2 = stat2.upper()
-        plt.scatter(self.__batter_stats[stat1], self.__batter_stats[stat2])
-        plt.xlabel(stat1)
-        plt.ylabel(stat2)
-        plt.title(("%s versus %s") % (stat2, stat1))
-        plt.show()
+        self.__show_chart(('stat-by-stat', stat1, stat2))
 
     # Purpose: Graphs a bar graph with 2 bars per stat, comparing two specified
     #          teams in each stat, respectively.
     # Arguments: Two strings: the two baseball teams' abbreviations.
     # Returns: Nothing.
-    # Sources: I consulted source # 2 for help on
-    #          graphing multiple bars (see ReadMe for details)
     def graph_team_comparison(self, team_abbrev1, team_abbrev2):
-        team1 = \
-        self.__batter_stats[self.__batter_stats['Team'] == team_abbrev1]
-        team1_edit = team1.drop(['POS', 'Team', 'CS', 'AVG', 'SLG', 'OBP', \
-                                 'OPS'], axis = 1)
-        team1_edit_summed = team1_edit.sum()
-        length = np.arange(team1_edit_summed.size)
-        first = plt.bar(length, team1_edit_summed, color = 'b', width = 0.34)
-        team2 = \
-        self.__batter_stats[self.__batter_stats['Team'] == team_abbrev2]
-        team2_edit = team2.drop(['POS', 'Team', 'CS', 'AVG', 'SLG', 'OBP', \
-                                 'OPS'], axis = 1)
-        team2_edit_summed = team2_edit.sum()
-        second = plt.bar(length + 0.34, team2_edit_summed, color = 'g', \
-                         width = 0.34)
-        plt.xticks(length + 0.17, team2_edit_summed.index)
-        plt.xlabel('Stats')
-        plt.ylabel('Scores in Each Stat')
-        plt.title(("A Comparison Between %s and %s in Each Stat") % \
-                                     (team_abbrev1, team_abbrev2))
-        plt.legend([first, second], [team_abbrev1, team_abbrev2])
-        plt.show()
+        self.__show_chart(('team-comparison', team_abbrev1, team_abbrev2))
+
+# Purpose: Draws a chart on a matplotlib Figure.
+# Arguments: A Figure: the figure. A tuple: the chart's payload (see
+#            BaseballAnalytics.get_chart_payload).
+# Returns: Nothing.
+# Sources: I consulted source # 2 for help on graphing multiple bars (see
+#          ReadMe for details)
+def draw_chart(figure, payload):
+    axes = figure.add_subplot(1, 1, 1)
+    kind = payload[0]
+    if kind == 'team-by-stat':
+        stat, teams, sums = payload[1:]
+        axes.barh(np.arange(len(teams)), sums)
+        axes.set_yticks(np.arange(len(teams)))
+        axes.set_yticklabels(teams)
+        axes.set_xlabel(stat)
+        axes.set_ylabel('Team')
+        axes.set_title(("%s By Team") % (stat))
+    elif kind == 'stat-by-stat':
+        stat1, stat2, scores1, scores2 = payload[1:]
+        axes.scatter(scores1, scores2)
+        axes.set_xlabel(stat1)
+        axes.set_ylabel(stat2)
+        axes.set_title(("%s versus %s") % (stat2, stat1))
+    elif kind == 'team-comparison':
+        team_abbrev1, team_abbrev2, stats, sums1, sums2 = payload[1:]
+        length = np.arange(len(stats))
+        first = axes.bar(length, sums1, color = 'b', width = 0.34)
+        second = axes.bar(length + 0.34, sums2, color = 'g', width = 0.34)
+        axes.set_xticks(length + 0.17)
+        axes.set_xticklabels(stats)
+        axes.set_xlabel('Stats')
+        axes.set_ylabel('Scores in Each Stat')
+        axes.set_title(("A Comparison Between %s and %s in Each Stat") % \
+                       (team_abbrev1, team_abbrev2))
+        axes.legend([first, second], [team_abbrev1, team_abbrev2])
+
+# Purpose: Renders a chart to an image file on a standalone Figure, which
+#          needs no display and no pyplot state. matplotlib is only imported
+#          here and in the interactive graph methods.
+# Arguments: A tuple: the chart's payload. A string: the file path (the
+#            format is taken from the extension).
+# Returns: A string: the file path.
+def render_chart(payload, path):
+    from matplotlib.figure import Figure
+    figure = Figure()
+    draw_chart(figure, payload)
+    figure.savefig(path)
+    return path
+
+class Instrumentation(object):
+
+    # Purpose: Initializes the instrumentation. When enabled, tracemalloc is
+    #          started, and every measured command and method call records
+    #          its wall time, CPU time, net allocations and call count. In
+    #          profiling mode, each top-level command also dumps a cProfile
+    #          file and its top allocation sites to the profile directory.
+    # Arguments: A boolean: whether to record anything. A string: the
+    #            profile directory (None disables profiling).
+    # Returns: Nothing.
+    def __init__(self, enabled = True, profile_dir = None):
+        self.__enabled = enabled or profile_dir is not None
+        self.__profile_dir = profile_dir
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__records = {}
+        self.__hooks = []
+        self.__num_profiles = 0
+        self.__random = np.random.default_rng()
+        self.__started_tracing = False
+        if profile_dir is not None and not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+        if self.__enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__started_tracing = True
+
+    # Purpose: Adds a hook that is called after every measured call, e.g. to
+    #          export the metrics from the batch or server modes.
+    # Arguments: A function: the hook, called with the call's name and a
+    #            dictionary of its metrics ('wall', 'cpu', 'alloc', 'depth'
+    #            and 'error', which is None if the call succeeded).
+    # Returns: Nothing.
+    def add_hook(self, hook):
+        self.__hooks.append(hook)
+
+    # Purpose: Gets a call name's record, creating it if needed. The caller
+    #          must hold the lock.
+    # Arguments: A string: the call's name.
+    # Returns: A dictionary: the record.
+    def __get_record(self, name):
+        if name not in self.__records:
+            self.__records[name] = {'calls': 0, 'total': 0.0, 'wall': [], \
+                                    'cpu': 0.0, 'alloc': 0, 'errors': 0}
+        return self.__records[name]
+
+    # Purpose: Records one call and runs the hooks. The wall times are kept
+    #          as a reservoir sample of at most INSTRUMENTATION_SAMPLES per
+    #          call name, so memory stays bounded however many calls are
+    #          made.
+    # Arguments: A string: the call's name. A dictionary: its metrics.
+    # Returns: Nothing.
+    def __record(self, name, metrics):
+        with self.__lock:
+            record = self.__get_record(name)
+            record['calls'] += 1
+            record['total'] += metrics['wall']
+            if len(record['wall']) < INSTRUMENTATION_SAMPLES:
+                record['wall'].append(metrics['wall'])
+            else:
+                sample = self.__random.integers(record['calls'])
+                if sample < INSTRUMENTATION_SAMPLES:
+                    record['wall'][sample] = metrics['wall']
+            record['cpu'] += metrics['cpu']
+            record['alloc'] += metrics['alloc']
+            record['errors'] += int(metrics['error'] is not None)
+        for hook in self.__hooks:
+            hook(name, metrics)
+
+    # Purpose: Records an error that a caller caught and handled itself, so
+    #          it is not lost.
+    # Arguments: A string: the call's name. An Exception: the error.
+    # Returns: Nothing.
+    def record_error(self, name, error):
+        if not self.__enabled:
+            return
+        with self.__lock:
+            record = self.__get_record(name)
+            record['errors'] += 1
+        for hook in self.__hooks:
+            hook(name, {'wall': 0.0, 'cpu': 0.0, 'alloc': 0, 'depth': 0, \
+                        'error': ("%s: %s") % (type(error).__name__, error)})
+
+    # Purpose: Dumps a top-level command's cProfile data and top allocation
+    #          sites to the profile directory.
+    # Arguments: A string: the command. A Profile: the command's profile. A
+    #            Snapshot: the tracemalloc snapshot taken before the command.
+    # Returns: Nothing.
+    def __dump_profile(self, name, profile, before):
+        with self.__lock:
+            self.__num_profiles += 1
+            prefix = os.path.join(self.__profile_dir, "%05d-%s" % \
+                                  (self.__num_profiles, \
+                                   name.replace('/', '_').replace(':', '_')))
+        profile.dump_stats(prefix + '.prof')
+        # Leave out the profiler's and tracemalloc's own allocations.
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), \
+                   tracemalloc.Filter(False, cProfile.__file__)]
+        after = tracemalloc.take_snapshot().filter_traces(filters)
+        before = before.filter_traces(filters)
+        with open(prefix + '.alloc.txt', 'w') as alloc_file:
+            for stat in after.compare_to(before, 'lineno')[:25]:
+                alloc_file.write(str(stat) + '\n')
+
+    # Purpose: Measures a block of code as one call. Calls nested in the
+    #          block (e.g. the methods a command uses) are measured too.
+    # Arguments: A string: the call's name. A function: returns the total
+    #            seconds spent idle (e.g. waiting for input), which are not
+    #            counted in the call's wall time (optional).
+    # Returns: A context manager.
+    @contextlib.contextmanager
+    def measure(self, name, idle = None):
+        if not self.__enabled:
+            yield
+            return
+        depth = getattr(self.__local, 'depth', 0)
+        self.__local.depth = depth + 1
+        profile = None
+        if self.__profile_dir is not None and depth == 0:
+            before = tracemalloc.take_snapshot()
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is already active (e.g. in a server
+                # thread), so this command is only timed.
+                profile = None
+        tracing = tracemalloc.is_tracing()
+        alloc_start = tracemalloc.get_traced_memory()[0] if tracing else 0
+        idle_start = idle() if idle is not None else 0.0
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        error = None
+        try:
+            yield
+        except Exception as exception:
+            error = ("%s: %s") % (type(exception).__name__, exception)
+            raise
+        finally:
+            wall = time.perf_counter() - wall_start
+            if idle is not None:
+                wall -= idle() - idle_start
+            cpu = time.process_time() - cpu_start
+            alloc = tracemalloc.get_traced_memory()[0] - alloc_start if \
+                    tracing else 0
+            self.__local.depth = depth
+            if profile is not None:
+                profile.disable()
+                self.__dump_profile(name, profile, before)
+            self.__record(name, {'wall': wall, 'cpu': cpu, 'alloc': alloc, \
+                                 'depth': depth, 'error': error})
+
+    # Purpose: Measures every public method of an object, by replacing each
+    #          method on the object with a measured wrapper.
+    # Arguments: An object: e.g. a BaseballAnalytics object.
+    # Returns: Nothing.
+    def wrap(self, obj):
+        if not self.__enabled:
+            return
+        for name in dir(obj):
+            method = getattr(obj, name)
+            if name.startswith('_') or not callable(method):
+                continue
+            setattr(obj, name, self.__wrap_method(name, method))
+
+    # Purpose: Wraps one method in a measured call.
+    # Arguments: A string: the method's name. A function: the method.
+    # Returns: A function: the wrapped method.
+    def __wrap_method(self, name, method):
+        @functools.wraps(method)
+        def measured(*args, **kwargs):
+            with self.measure('method:' + name):
+                return method(*args, **kwargs)
+        return measured
+
+    # Purpose: Summarizes the recorded calls.
+    # Arguments: None.
+    # Returns: A DataFrame: for each call name, the number of calls and
+    #          errors, the total wall time and the p50 and p95 wall times
+    #          (estimated from the sampled calls; in milliseconds),
+    #          the total CPU time (in milliseconds) and the net allocations
+    #          (in bytes).
+    def get_summary(self):
+        rows = []
+        with self.__lock:
+            for name, record in sorted(self.__records.items()):
+                walls = np.array(record['wall']) * 1000
+                rows.append((name, record['calls'], record['errors'], \
+                             record['total'] * 1000, \
+                             np.percentile(walls, 50) if len(walls) else \
+                             np.nan, \
+                             np.percentile(walls, 95) if len(walls) else \
+                             np.nan, \
+                             record['cpu'] * 1000, record['alloc']))
+        return pd.DataFrame(rows, columns = ['Name', 'Calls', 'Errors', \
+                                             'Total_ms', 'p50_ms', 'p95_ms', \
+                                             'CPU_ms', 'Alloc_bytes'])\
+                 .set_index('Name')
+
+    # Purpose: Writes the summary report, and stops tracemalloc if it was
+    #          started for the instrumentation.
+    # Arguments: A file: where the report is written.
+    # Returns: Nothing.
+    def close(self, output = None):
+        if not self.__enabled:
+            return
+        output = sys.stderr if output is None else output
+        with pd.option_context('display.width', 200, \
+                               'display.max_rows', None, \
+                               'display.max_columns', None, \
+                               'display.float_format', '{:.3f}'.format):
+            output.write(str(self.get_summary()) + '\n')
+        if self.__started_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self.__started_tracing = False
+
+STAT_PROMPT = "Enter a stat (G, AB, R, H, 2B, 3B, HR, RBI, BB, K, SB, " + \
+              "CS, AVG, SLG, OBP, OPS, or a derived stat: " + \
+              ", ".join(DERIVED_STATS) + "): "
+
+COMMANDS = ['Get-Standings', 'Get-Roster', 'Get-Player-Stats', \
+            'Get-Avg-Team-Stats', 'Get-Med-Team-Stats', 'Get-Std-Team-Stats', \
+            'Get-Mean-Stat', 'Get-Median-Stat', 'Get-Std-Stat', \
+            'Get-Max-Stat-Player', 'Get-Quantile-Stat', \
+            'Get-Player-Quantile', \
+            'Graph-Team-By-Stat', 'Graph-Stat-By-Stat', \
+            'Graph-Team-Comparison', 'Find-Player', 'Search-Player', \
+            'Get-Load-Time', 'Get-Memory-Usage', 'Get-Seasons', \
+            'Get-Career-Stats', 'Get-Division-Standings', \
+            'Get-Playoff-Odds', 'Get-Similar-Players', \
+            'Get-Stat-Interval', 'Get-Team-Stat-Intervals', \
+            'List-Of-Commands']
+
+class CommandError(Exception):
+    pass
+
+# Purpose: Checks a stat argument.
+# Arguments: A BaseballAnalytics: the analytics. A string: the stat.
+# Returns: A string: the stat's name (see BaseballAnalytics.get_stat_name).
+def check_stat(ba, stat):
+    stat = ba.get_stat_name(stat)
+    if stat is None:
+        raise CommandError("Invalid Stat")
+    return stat
+
+# Purpose: Checks that a command was given the right number of arguments.
+# Arguments: A list: the arguments. An int: the expected number.
+# Returns: Nothing.
+def check_args(args, count):
+    if len(args) != count:
+        raise CommandError(("Expected %d argument(s), got %d") % \
+                           (count, len(args)))
+
+# Purpose: Runs one program command against a loaded BaseballAnalytics
+#          object. The arguments are the answers to the interactive command's
+#          prompts, in the same order.
+# Arguments: A BaseballAnalytics: the analytics. A string: the command (case
+#            insensitive). A list: the command's arguments. An int: the
+#            number of processes for simulations and resampling (defaults to
+#            the number of CPUs).
+# Returns: The command's result (a DataFrame, Series, dictionary, list or
+#          number). Raises a CommandError if the command or its arguments are
+#          invalid.
+def run_command(ba, command, args, processes = None):
+    command = command.lower()
+    if command in ("get-standings", "get-avg-team-stats", \
+                   "get-med-team-stats", "get-std-team-stats", \
+                   "get-load-time", "get-memory-usage", "get-seasons", \
+                   "get-division-standings", "list-of-commands"):
+        check_args(args, 0)
+    if command == "get-standings":
+        return ba.get_standings()
+    elif command == "get-roster":
+        check_args(args, 1)
+        try:
+            team_abbrev = ba.name_to_abbrev(args[0])
+        except KeyError:
+            raise CommandError("Invalid Team Name")
+        return ba.get_team_roster(team_abbrev)
+    elif command == "get-player-stats":
+        check_args(args, 2)
+        try:
+            return ba.get_player_stats(args[0], args[1])
+        except KeyError:
+            raise CommandError("Invalid Player Name")
+    elif command == "get-avg-team-stats":
+        return ba.get_avg_team_stats()
+    elif command == "get-med-team-stats":
+        return ba.get_med_team_stats()
+    elif command == "get-std-team-stats":
+        return ba.get_std_team_stats()
+    elif command == "get-mean-stat":
+        check_args(args, 1)
+        return ba.get_mean_stat(check_stat(ba, args[0]))
+    elif command == "get-median-stat":
+        check_args(args, 1)
+        return ba.get_median_stat(check_stat(ba, args[0]))
+    elif command == "get-std-stat":
+        check_args(args, 1)
+        return ba.get_std_stat(check_stat(ba, args[0]))
+    elif command == "get-max-stat-player":
+        check_args(args, 1)
+        return ba.get_max_stat_player(check_stat(ba, args[0]))
+    elif command == "get-quantile-stat":
+        check_args(args, 2)
+        stat = check_stat(ba, args[0])
+        try:
+            quantile = float(args[1])
+        except ValueError:
+            raise CommandError("Invalid Quantile")
+        if not 0 <= quantile <= 1:
+            raise CommandError("Invalid Quantile")
+        return ba.get_quantile_stat(stat, quantile)
+    elif command == "get-player-quantile":
+        check_args(args, 2)
+        try:
+            return ba.get_player_quantile(args[0], args[1])
+        except KeyError:
+            raise CommandError("Invalid Player")
+    elif command == "find-player":
+        check_args(args, 1)
+        return ba.find_players(args[0])
+    elif command == "search-player":
+        check_args(args, 1)
+        return ba.search_players(args[0])
+    elif command == "get-load-time":
+        source, seconds = ba.get_load_time()
+        return {'source': source, 'seconds': seconds}
+    elif command == "get-memory-usage":
+        return ba.get_memory_usage()
+    elif command == "get-seasons":
+        return ba.get_seasons()
+    elif command == "get-division-standings":
+        try:
+            return ba.get_division_standings()
+        except ValueError:
+            raise CommandError("No Game Results")
+    elif command == "get-playoff-odds":
+        check_args(args, 2)
+        try:
+            num_simulations = int(args[0])
+            seed = None if str(args[1]).lower() == 'random' else int(args[1])
+        except ValueError:
+            raise CommandError("Invalid Simulations or Seed")
+        if num_simulations < 1:
+            raise CommandError("Invalid Simulations or Seed")
+        try:
+            return ba.get_playoff_odds(num_simulations, seed, processes)
+        except ValueError:
+            raise CommandError("No Game Results")
+    elif command in ("get-stat-interval", "get-team-stat-intervals"):
+        check_args(args, 4 if command == "get-stat-interval" else 3)
+        summary = str(args[0]).lower()
+        if summary not in ('mean', 'median', 'std'):
+            raise CommandError("Invalid Summary")
+        if command == "get-stat-interval":
+            stat = check_stat(ba, args[1])
+        try:
+            num_resamples = int(args[-2])
+            seed = None if str(args[-1]).lower() == 'random' else \
+                   int(args[-1])
+        except ValueError:
+            raise CommandError("Invalid Resamples or Seed")
+        if num_resamples < 1:
+            raise CommandError("Invalid Resamples or Seed")
+        if command == "get-stat-interval":
+            return ba.get_stat_interval(stat, summary, num_resamples, \
+                                        seed = seed, processes = processes)
+        return ba.get_team_stat_intervals(summary, num_resamples, \
+                                          seed = seed, processes = processes)
+    elif command == "get-similar-players":
+        check_args(args, 4)
+        try:
+            k = int(args[2])
+            min_ab = int(args[3])
+        except ValueError:
+            raise CommandError("Invalid K or Min AB")
+        try:
+            return ba.get_similar_players(args[0], args[1], k, min_ab)
+        except KeyError:
+            raise CommandError("Invalid Player Name")
+    elif command == "get-career-stats":
+        check_args(args, 2)
+        try:
+            return ba.get_career_stats(args[0], args[1])
+        except KeyError:
+            raise CommandError("Invalid Player Name")
+    elif command == "list-of-commands":
+        return COMMANDS
+    elif command.startswith("graph-") and command in \
+         [name.lower() for name in COMMANDS]:
+        raise CommandError("Graph commands are interactive only")
+    raise CommandError("Invalid Command")
+
+# Purpose: Converts a column to a list of plain Python values. float32
+#          scores are written with their shortest float32 repr (0.44444445,
+#          not 0.4444444477558136), and NaNs become None.
+# Arguments: A Series: the column.
+# Returns: A list: the values.
+def to_values(column):
+    if column.dtype == np.float32:
+        column = column.astype(str).astype(np.float64)
+    values = column.tolist()
+    if column.dtype == object:
+        # e.g. a player's row in the compact layout, which mixes dtypes.
+        values = [float(str(value)) if isinstance(value, np.float32) else \
+                  value.item() if isinstance(value, np.generic) else value \
+                  for value in values]
+    if column.hasnans:
+        values = [None if value != value else value for value in values]
+    return values
+
+# Purpose: Converts a command's result to plain Python values that can be
+#          written as JSON.
+# Arguments: The command's result.
+# Returns: The result as dictionaries, lists, strings and numbers. NaNs
+#          become None.
+def to_record(result):
+    if isinstance(result, pd.Series):
+        return {'index': result.index.tolist(),
+                'values': to_values(result)}
+    if isinstance(result, pd.DataFrame):
+        columns = [to_values(result.iloc[:, i]) for i in \
+                   range(len(result.columns))]
+        return {'index': result.index.tolist(),
+                'columns': [str(column) for column in result.columns],
+                'data': [list(row) for row in zip(*columns)]}
+    if isinstance(result, dict):
+        return dict((key, to_record(value)) for key, value in result.items())
+    if isinstance(result, (list, tuple)):
+        return [to_record(value) for value in result]
+    if isinstance(result, np.generic):
+        result = result.item()
+    if isinstance(result, float) and np.isnan(result):
+        return None
+    return result
+
+# Purpose: Parses one line of a batch file. A line is either a JSON object,
+#          {"command": "Get-Roster", "args": ["Boston Red Sox"]}, or a
+#          command and its arguments separated by tabs.
+# Arguments: A string: the line.
+# Returns: A tuple: the command and a list of its arguments, and the
+#          request's id (None unless the JSON object has an "id").
+def parse_batch_line(line):
+    if line.startswith('{'):
+        request = json.loads(line)
+        args = request.get('args', [])
+        if not isinstance(args, list):
+            args = [args]
+        return request['command'], args, request.get('id')
+    fields = line.split('\t')
+    return fields[0].strip(), [field.strip() for field in fields[1:]], None
+
+# Purpose: Runs a batch of commands against one loaded BaseballAnalytics
+#          object, writing one JSON record per command. A command that fails
+#          writes an error record, and the batch continues. The data does
+#          not change during a batch, so the results of the most recent
+#          BATCH_MEMO_SIZE distinct commands are reused for repeats (except
+#          for commands with a 'random' seed).
+# Arguments: A BaseballAnalytics: the analytics. A file: the commands, one
+#            per line (blank lines and lines starting with '#' are skipped).
+#            A file: where the records are written. An Instrumentation:
+#            measures each command (optional).
+# Returns: A tuple: the number of commands run and the number that failed.
+def run_batch(ba, commands, output, instrumentation = None):
+    if instrumentation is None:
+        instrumentation = Instrumentation(False)
+    num_run = 0
+    num_failed = 0
+    results = collections.OrderedDict()
+    for line_number, line in enumerate(commands, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        num_run += 1
+        record = {'line': line_number}
+        try:
+            command, args, request_id = parse_batch_line(line)
+            if request_id is not None:
+                record['id'] = request_id
+            record['command'] = command
+            key = (command.lower(), tuple(str(arg) for arg in args))
+            reuse = not (key[0] in SEEDED_COMMANDS and key[1] and \
+                         key[1][-1].lower() == 'random')
+            with instrumentation.measure('command:' + key[0]):
+                if reuse and key in results:
+                    results.move_to_end(key)
+                    ok, result = results[key]
+                else:
+                    try:
+                        ok, result = True, to_record(run_command(ba, \
+                                                                 command, \
+                                                                 args))
+                    except CommandError as error:
+                        ok, result = False, error
+                    if reuse:
+                        results[key] = (ok, result)
+                        if len(results) > BATCH_MEMO_SIZE:
+                            results.popitem(last = False)
+                if not ok:
+                    raise result
+            record['result'] = result
+            record['ok'] = True
+        except CommandError as error:
+            record['ok'] = False
+            record['error'] = str(error)
+            num_failed += 1
+        except Exception as error:
+            record['ok'] = False
+            record['error'] = ("%s: %s") % (type(error).__name__, error)
+            num_failed += 1
+        output.write(json.dumps(record) + '\n')
+    output.flush()
+    return num_run, num_failed
+
+# The server's endpoints: each path with its command and the names of the
+# query parameters that are passed (in order) as the command's arguments.
+ENDPOINTS = {'/standings': ('Get-Standings', []),
+             '/roster': ('Get-Roster', ['team']),
+             '/player-stats': ('Get-Player-Stats', ['last', 'first']),
+             '/avg-team-stats': ('Get-Avg-Team-Stats', []),
+             '/med-team-stats': ('Get-Med-Team-Stats', []),
+             '/std-team-stats': ('Get-Std-Team-Stats', []),
+             '/mean-stat': ('Get-Mean-Stat', ['stat']),
+             '/median-stat': ('Get-Median-Stat', ['stat']),
+             '/std-stat': ('Get-Std-Stat', ['stat']),
+             '/max-stat-player': ('Get-Max-Stat-Player', ['stat']),
+             '/quantile-stat': ('Get-Quantile-Stat', ['stat', 'quantile']),
+             '/player-quantile': ('Get-Player-Quantile', ['last', 'first']),
+             '/find-player': ('Find-Player', ['prefix']),
+             '/search-player': ('Search-Player', ['name']),
+             '/load-time': ('Get-Load-Time', []),
+             '/memory-usage': ('Get-Memory-Usage', []),
+             '/seasons': ('Get-Seasons', []),
+             '/career-stats': ('Get-Career-Stats', ['last', 'first']),
+             '/division-standings': ('Get-Division-Standings', []),
+             '/playoff-odds': ('Get-Playoff-Odds', ['simulations', 'seed']),
+             '/similar-players': ('Get-Similar-Players', ['last', 'first', \
+                                                          'k', 'min_ab']),
+             '/stat-interval': ('Get-Stat-Interval', ['summary', 'stat', \
+                                                      'resamples', 'seed']),
+             '/team-stat-intervals': ('Get-Team-Stat-Intervals', \
+                                      ['summary', 'resamples', 'seed'])}
+
+class QueryStats(object):
+
+    # Purpose: Initializes the server's per-endpoint counters.
+    # Arguments: None.
+    # Returns: Nothing.
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__start = time.time()
+        self.__counters = {}
+
+    # Purpose: Records one request.
+    # Arguments: A string: the endpoint. A float: the request's latency in
+    #            seconds. A boolean: whether the request failed.
+    # Returns: Nothing.
+    def record(self, endpoint, seconds, failed):
+        with self.__lock:
+            counter = self.__counters.setdefault(endpoint, \
+                                                 [0, 0, 0.0, 0.0])
+            counter[0] += 1
+            counter[1] += int(failed)
+            counter[2] += seconds
+            counter[3] = max(counter[3], seconds)
+
+    # Purpose: Gets the counters.
+    # Arguments: None.
+    # Returns: A dictionary: the server's uptime, overall throughput and,
+    #          for each endpoint, its request and error counts, mean and max
+    #          latency (in milliseconds) and throughput (requests/second).
+    def get_report(self):
+        with self.__lock:
+            uptime = time.time() - self.__start
+            endpoints = {}
+            total = 0
+            for endpoint, (count, errors, seconds, max_seconds) in \
+                self.__counters.items():
+                endpoints[endpoint] = {'requests': count,
+                                       'errors': errors,
+                                       'mean_ms': 1000 * seconds / count,
+                                       'max_ms': 1000 * max_seconds,
+                                       'per_second': count / uptime}
+                total += count
+        return {'uptime_seconds': uptime,
+                'requests': total,
+                'per_second': total / uptime,
+                'endpoints': endpoints}
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+
+    # Purpose: Writes a JSON response.
+    # Arguments: An int: the HTTP status. A dictionary: the response body.
+    # Returns: Nothing.
+    def __respond(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Purpose: Runs a command and writes its result, recording the request's
+    #          latency under the endpoint.
+    # Arguments: A string: the endpoint. A string: the command. A list: the
+    #            command's arguments. The request's id (echoed back if given).
+    # Returns: Nothing.
+    def __run(self, endpoint, command, args, request_id = None):
+        start = time.perf_counter()
+        try:
+            status = 200
+            with self.server.instrumentation.measure('endpoint:' + endpoint):
+                # Simulations and resampling run in this process: forking a
+                # process pool from a threaded server isn't safe.
+                body = {'ok': True, 'result': to_record(run_command(\
+                       self.server.ba, command, args, 1))}
+        except CommandError as error:
+            status = 400
+            body = {'ok': False, 'error': str(error)}
+        except Exception as error:
+            status = 500
+            body = {'ok': False, 'error': ("%s: %s") % \
+                                          (type(error).__name__, error)}
+        self.server.query_stats.record(endpoint, time.perf_counter() - \
+                                       start, status != 200)
+        if request_id is not None:
+            body['id'] = request_id
+        self.__respond(status, body)
+
+    # Purpose: Handles a GET request: one of the ENDPOINTS, with the
+    #          command's arguments as query parameters, or '/stats' for the
+    #          server's counters.
+    # Arguments: None.
+    # Returns: Nothing.
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            self.__respond(200, {'ok': True, 'result': \
+                                 self.server.query_stats.get_report()})
+            return
+        if url.path not in ENDPOINTS:
+            self.__respond(404, {'ok': False, 'error': "Invalid Endpoint"})
+            return
+        command, names = ENDPOINTS[url.path]
+        params = parse_qs(url.query)
+        missing = [name for name in names if name not in params]
+        if missing:
+            self.__respond(400, {'ok': False, 'error': "Missing " + \
+                                 ", ".join(missing)})
+            return
+        self.__run(url.path, command, [params[name][0] for name in names])
+
+    # Purpose: Handles a POST to '/command' with a JSON body in the batch
+    #          format: {"command": "Get-Roster", "args": ["Boston Red Sox"]}.
+    # Arguments: None.
+    # Returns: Nothing.
+    def do_POST(self):
+        if urlparse(self.path).path != '/command':
+            self.__respond(404, {'ok': False, 'error': "Invalid Endpoint"})
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            command, args, request_id = \
+            parse_batch_line(self.rfile.read(length).decode('utf-8').strip())
+        except (ValueError, KeyError):
+            self.__respond(400, {'ok': False, 'error': "Invalid Request"})
+            return
+        self.__run('/command', command, args, request_id)
+
+    # Purpose: Silences the per-request log lines.
+    # Arguments: A string: the format. The format's arguments.
+    # Returns: Nothing.
+    def log_message(self, format, *args):
+        pass
+
+# Purpose: Creates the query server. Each request is handled on its own
+#          thread against the one loaded BaseballAnalytics object.
+# Arguments: A BaseballAnalytics: the analytics. A string: the host. An int:
+#            the port (0 picks a free port). An Instrumentation: measures
+#            each request (optional).
+# Returns: A ThreadingHTTPServer: the server (call serve_forever() to run
+#          it).
+def make_server(ba, host = '127.0.0.1', port = 8016, instrumentation = None):
+    server = ThreadingHTTPServer((host, port), QueryRequestHandler)
+    server.daemon_threads = True
+    server.ba = ba
+    server.query_stats = QueryStats()
+    if instrumentation is None:
+        instrumentation = Instrumentation(False)
+    server.instrumentation = instrumentation
+    return server
+
+# Purpose: Parses the program's command line arguments.
+# Arguments: A list of strings: the arguments (defaults to sys.argv).
+# Returns: An argparse Namespace: the parsed arguments.
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = "Analyzes and graphs " + \
+                                     "2016 MLB batting data.")
+    parser.add_argument('--stats-file', default = 'mlb-stats2016.xlsx', \
+                        help = "the stats workbook, or a directory or " + \
+                        "JSON manifest of season workbooks")
+    parser.add_argument('--no-cache', action = 'store_true', \
+                        help = "parse the workbook instead of using the " + \
+                        "columnar cache")
+    parser.add_argument('--compact', action = 'store_true', \
+                        help = "store the batters' stats in the compact " + \
+                        "memory layout")
+    parser.add_argument('--results', metavar = 'FILE', \
+                        help = "compute the standings from the game " + \
+                        "results in FILE (CSV or JSON lines)")
+    parser.add_argument('--ingest', metavar = 'FILE', action = 'append', \
+                        help = "apply the game lines in FILE (CSV or " + \
+                        "JSON lines) to the batters' stats before running")
+    parser.add_argument('--batch', metavar = 'FILE', \
+                        help = "run the commands in FILE ('-' for stdin) " + \
+                        "and write one JSON record per command")
+    parser.add_argument('--output', metavar = 'FILE', \
+                        help = "where batch records are written " + \
+                        "(defaults to stdout)")
+    parser.add_argument('--serve', action = 'store_true', \
+                        help = "run a local HTTP query server")
+    parser.add_argument('--host', default = '127.0.0.1', \
+                        help = "the server's host")
+    parser.add_argument('--port', type = int, default = 8016, \
+                        help = "the server's port")
+    parser.add_argument('--instrument', action = 'store_true', \
+                        help = "time every command and method, and print " + \
+                        "a latency report on exit")
+    parser.add_argument('--profile', metavar = 'DIR', \
+                        help = "also dump each command's cProfile data " + \
+                        "and tracemalloc allocation sites to DIR")
+    parser.add_argument('--metrics', metavar = 'FILE', \
+                        help = "write one JSON record per measured call " + \
+                        "to FILE")
+    parser.add_argument('--render', metavar = 'KIND', action = 'append', \
+                        choices = ['team-by-stat', 'stat-by-stat', \
+                                   'team-comparison'], \
+                        help = "render every chart of KIND (team-by-stat, " + \
+                        "stat-by-stat or team-comparison) to image files")
+    parser.add_argument('--chart-dir', default = 'charts', \
+                        help = "where rendered charts are written")
+    parser.add_argument('--format', default = 'png', \
+                        choices = ['png', 'svg'], \
+                        help = "the rendered charts' image format")
+    parser.add_argument('--processes', type = int, default = None, \
+                        help = "the number of processes that render charts")
+    return parser.parse_args(argv)
 
 # Purpose: Runs and controls the BaseballAnalytics program.
-# Arguments: None.
+# Arguments: A list of strings: the command line arguments (defaults to
+#            sys.argv).
+# Returns: Nothing.
+def main(argv = None):
+    args = parse_args(argv)
+    instrumentation = Instrumentation(args.instrument or \
+                                      args.metrics is not None, args.profile)
+    metrics = None
+    if args.metrics is not None:
+        metrics = open(args.metrics, 'w')
+        metrics_lock = threading.Lock()
+        def write_metrics(name, call_metrics):
+            record = dict(call_metrics, name = name, time = time.time())
+            with metrics_lock:
+                metrics.write(json.dumps(record) + '\n')
+        instrumentation.add_hook(write_metrics)
+    try:
+        with instrumentation.measure('load'):
+            ba = BaseballAnalytics(args.stats_file, not args.no_cache, \
+                                   args.compact)
+        instrumentation.wrap(ba)
+        if args.results is not None:
+            ba.load_game_results(args.results)
+        for path in args.ingest or []:
+            start = time.perf_counter()
+            num_lines, num_players = ba.ingest_game_logs(path)
+            sys.stderr.write(("Applied %d game lines (%d players) from %s " + \
+                              "in %.3f seconds\n") % (num_lines, \
+                              num_players, path, \
+                              time.perf_counter() - start))
+        run_mode(ba, args, instrumentation)
+    finally:
+        instrumentation.close()
+        if metrics is not None:
+            metrics.close()
+
+# Purpose: Runs the mode selected on the command line: rendering, the
+#          server, a batch or the interactive prompt.
+# Arguments: A BaseballAnalytics: the analytics. An argparse Namespace: the
+#            command line arguments. An Instrumentation: the
+#            instrumentation.
+# Returns: Nothing.
+def run_mode(ba, args, instrumentation):
+    if args.render:
+        start = time.perf_counter()
+        specs = []
+        for kind in args.render:
+            specs.extend(ba.get_chart_specs(kind))
+        paths = ba.render_charts(specs, args.chart_dir, args.format, \
+                                 args.processes)
+        sys.stderr.write(("Rendered %d charts to %s in %.1f seconds\n") % \
+                         (len(paths), args.chart_dir, \
+                          time.perf_counter() - start))
+        return
+    if args.serve:
+        server = make_server(ba, args.host, args.port, instrumentation)
+        sys.stderr.write(("Serving on http://%s:%d\n") % \
+                         server.server_address)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+    if args.batch is None:
+        run_interactive(ba, instrumentation)
+        return
+    commands = sys.stdin if args.batch == '-' else open(args.batch)
+    output = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        num_run, num_failed = run_batch(ba, commands, output, \
+                                        instrumentation)
+    finally:
+        if commands is not sys.stdin:
+            commands.close()
+        if output is not sys.stdout:
+            output.close()
+    sys.stderr.write(("Ran %d commands (%d failed)\n") % (num_run, num_failed))
+
+# Purpose: Runs the interactive prompt until the user enters 'End'.
+# Arguments: A BaseballAnalytics: the analytics. An Instrumentation:
+#            measures each command (optional).
 # Returns: Nothing.
-def main():
-    ba = BaseballAnalytics()
+def run_interactive(ba, instrumentation = None):
+    if instrumentation is None:
+        instrumentation = Instrumentation(False)
+    waiting = [0.0]
+    # Purpose: Prompts the user, keeping track of the time spent waiting so
+    #          it is not counted in the commands' latencies.
+    # Arguments: A string: the prompt.
+    # Returns: A string: the user's input.
+    def prompt(text):
+        start = time.perf_counter()
+        try:
+            return input(text)
+        finally:
+            waiting[0] += time.perf_counter() - start
+    idle = lambda: waiting[0]
     command = input("Greetings, this program analyzes and graphs 2016 " + \
           "MLB Data. Enter one of the following commands: 'Get-Standings'," + \
           " 'Get-Roster', 'Get-Player-Stats', 'Get-Avg-Team-Stats'," + \
@@ -302,130 +3823,225 @@ def main():
           " 'Get-Mean-Stat', 'Get-Median-Stat', 'Get-Std-Stat'," + \
           " 'Get-Max-Stat-Player', 'Get-Quantile-Stat'," + \
           " 'Get-Player-Quantile', 'Graph-Team-By-Stat'," + \
-          " 'Graph-Stat-By-Stat', 'Graph-Team-Comparison', or" + \
+          " 'Graph-Stat-By-Stat', 'Graph-Team-Comparison'," + \
+          " 'Find-Player', 'Search-Player', 'Get-Load-Time'," + \
+          " 'Get-Memory-Usage', 'Get-Seasons', 'Get-Career-Stats'," + \
+          " 'Get-Division-Standings', 'Get-Playoff-Odds'," + \
+          " 'Get-Similar-Players', 'Get-Stat-Interval'," + \
+          " 'Get-Team-Stat-Intervals', or" + \
           " 'List-Of-Commands': ")
     command = command.lower()
     while command != 'end':
-        if command == "get-standings":
-            print(ba.get_standings())
-        elif command == "get-roster":
-            team_name = input("Enter a team name: ")
-            try:
-                team_abbrev = ba.name_to_abbrev(team_name)
-                print(ba.get_team_roster(team_abbrev))
-            except:
-                print("Invalid Team Name")
-        elif command == "get-player-stats":
-            lastn = input("Input player's last name: ")
-            firstn = input("Input player's first name: ")
-            try:
-                print(ba.get_player_stats(lastn, firstn))
-            except:
-                print("Invalid Player Name")
-        elif command == "get-avg-team-stats":
-            print(ba.get_avg_team_stats())
-        elif command == "get-med-team-stats":
-            print(ba.get_med_team_stats())
-        elif command == "get-std-team-stats":
-            print(ba.get_std_team_stats())
-        elif command == "get-mean-stat":
-            stat = input("Enter a stat (G, AB, R, H, 2B, 3B, HR, RBI, " + \
-                         "BB, K, SB, CS, AVG, SLG, OBP, OPS): ")
-            try:
-                mean = ba.get_mean_stat(stat.upper())
-                print(("The mean %s is: %.3f") % (stat.upper(), mean))
-            except:
-                print("Invalid Stat")
-        elif command == "get-median-stat":
-            stat = input("Enter a stat (G, AB, R, H, 2B, 3B, HR, RBI, " + \
-                         "BB, K, SB, CS, AVG, SLG, OBP, OPS): ")
-            try:
-                median = ba.get_median_stat(stat.upper())
-                print(("The median %s is: %.3f") % (stat.upper(), median))
-            except:
-                print("Invalid Stat")
-        elif command == "get-std-stat":
-            stat = input("Enter a stat (G, AB, R, H, 2B, 3B, HR, RBI, " + \
-                         "BB, K, SB, CS, AVG, SLG, OBP, OPS): ")
-            try:
-                std = ba.get_std_stat(stat.upper())
-                print(("The standard deviation of %s is: %.3f") % \
-                      (stat.upper(), std))
-            except:
-                print("Invalid Stat")
-        elif command == "get-max-stat-player":
-            stat = input("Enter a stat (G, AB, R, H, 2B, 3B, HR, RBI, " + \
-                         "BB, K, SB, CS, AVG, SLG, OBP, OPS): ")
-            try:
-                print(ba.get_max_stat_player(stat.upper()))
-            except:
-                print("Invalid Stat")
-        elif command == "get-quantile-stat":
-            stat = input("Enter a stat (G, AB, R, H, 2B, 3B, HR, RBI, " + \
-                         "BB, K, SB, CS, AVG, SLG, OBP, OPS): ")
-            stat = stat.upper()
-            if not (ba.is_in_stats(stat)):
-                print("Invalid Stat")
-            else:
-                quantile = float(input("Enter a quantile (between 0 and 1 " + \
-                                       "inclusive): "))
-                if quantile < 0 or quantile > 1:
-                    print("Invalid Quantile")
+        with instrumentation.measure('command:' + command, idle):
+            if command == "get-standings":
+                print(ba.get_standings())
+            elif command == "get-roster":
+                team_name = prompt("Enter a team name: ")
+                try:
+                    team_abbrev = ba.name_to_abbrev(team_name)
+                    print(ba.get_team_roster(team_abbrev))
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Team Name")
+            elif command == "get-player-stats":
+                lastn = prompt("Input player's last name: ")
+                firstn = prompt("Input player's first name: ")
+                try:
+                    print(ba.get_player_stats(lastn, firstn))
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Player Name")
+            elif command == "get-avg-team-stats":
+                print(ba.get_avg_team_stats())
+            elif command == "get-med-team-stats":
+                print(ba.get_med_team_stats())
+            elif command == "get-std-team-stats":
+                print(ba.get_std_team_stats())
+            elif command == "get-mean-stat":
+                stat = ba.get_stat_name(prompt(STAT_PROMPT))
+                try:
+                    mean = ba.get_mean_stat(stat)
+                    print(("The mean %s is: %.3f") % (stat, mean))
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Stat")
+            elif command == "get-median-stat":
+                stat = ba.get_stat_name(prompt(STAT_PROMPT))
+                try:
+                    median = ba.get_median_stat(stat)
+                    print(("The median %s is: %.3f") % (stat, median))
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Stat")
+            elif command == "get-std-stat":
+                stat = ba.get_stat_name(prompt(STAT_PROMPT))
+                try:
+                    std = ba.get_std_stat(stat)
+                    print(("The standard deviation of %s is: %.3f") % \
+                          (stat, std))
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Stat")
+            elif command == "get-max-stat-player":
+                stat = ba.get_stat_name(prompt(STAT_PROMPT))
+                try:
+                    print(ba.get_max_stat_player(stat))
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Stat")
+            elif command == "get-quantile-stat":
+                stat = ba.get_stat_name(prompt(STAT_PROMPT))
+                if not (ba.is_in_stats(stat)):
+                    print("Invalid Stat")
                 else:
-                    print(ba.get_quantile_stat(stat, quantile))
-        elif command == "get-player-quantile":
-            lastn = input("Input player's last name: ")
-            firstn = input("Input player's first name: ")
-            try:
-                ba.get_player_quantile(lastn, firstn)
-            except:
-                print("Invalid Player")
-        elif command == "graph-team-by-stat":
-            stat = input("Enter a stat (G, AB, R, H, 2B, 3B, HR, RBI, " + \
-                         "BB, K, SB, CS, AVG, SLG, OBP, OPS): ")
-            try:
-                ba.graph_team_by_stat(stat)
-            except:
-                print("Invalid Stat")
-        elif command == "graph-stat-by-stat":
-            stat1 = input("Enter a stat (G, AB, R, H, 2B, 3B, HR, RBI, " + \
-                         "BB, K, SB, CS, AVG, SLG, OBP, OPS): ")
-            stat2 = input("Enter a stat (G, AB, R, H, 2B, 3B, HR, RBI, " + \
-                         "BB, K, SB, CS, AVG, SLG, OBP, OPS): ")
-            try:
-                ba.graph_stat_by_stat(stat1, stat2)
-            except:
-                print("Invalid Stat(s)")
-        elif command == "graph-team-comparison":
-            team_name1 = input("Enter first team name: ")
-            team_name2 = input("Enter second team name: ")
-            try:
-                team_abbrev1 = ba.name_to_abbrev(team_name1)
-                team_abbrev2 = ba.name_to_abbrev(team_name2)
-                ba.graph_team_comparison(team_abbrev1, team_abbrev2)
-            except:
-                print("Invalid Team Name(s)")
-        elif command == "list-of-commands":
-            print("Here is a list of the program commands: \n" + \
-                  " 'Get-Standings' \n" + \
-                  " 'Get-Roster' \n" + \
-                  " 'Get-Player-Stats' \n" + \
-                  " 'Get-Avg-Team-Stats' \n" + \
-                  " 'Get-Med-Team-Stats' \n" + \
-                  " 'Get-Std-Team-Stats' \n" + \
-                  " 'Get-Mean-Stat' \n" + \
-                  " 'Get-Median-Stat' \n" + \
-                  " 'Get-Std-Stat' \n" + \
-                  " 'Get-Max-Stat-Player' \n" + \
-                  " 'Get-Quantile-Stat' \n" + \
-                  " 'Get-Player-Quantile' \n" + \
-                  " 'Graph-Team-By-Stat' \n" + \
-                  " 'Graph-Stat-By-Stat' \n" + \
-                  " 'Graph-Team-Comparison' \n" + \
-                  " 'List-Of-Commands' ")
-        else:
-            print("Invalid Command")
+                    try:
+                        quantile = float(prompt("Enter a quantile " + \
+                                                "(between 0 and 1 " + \
+                                                "inclusive): "))
+                        if not 0 <= quantile <= 1:
+                            raise ValueError("Invalid Quantile")
+                    except Exception as error:
+                        instrumentation.record_error('command:' + command, \
+                                                     error)
+                        print("Invalid Quantile")
+                    else:
+                        print(ba.get_quantile_stat(stat, quantile))
+            elif command == "get-player-quantile":
+                lastn = prompt("Input player's last name: ")
+                firstn = prompt("Input player's first name: ")
+                try:
+                    percentiles = ba.get_player_quantile(lastn, firstn)
+                    print("Name: " + (lastn + ", " + firstn).title())
+                    for stat in STATS:
+                        print(stat + ': ' + str(percentiles[stat]) + '%')
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Player")
+            elif command == "graph-team-by-stat":
+                stat = prompt(STAT_PROMPT)
+                try:
+                    ba.graph_team_by_stat(stat)
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Stat")
+            elif command == "graph-stat-by-stat":
+                stat1 = prompt(STAT_PROMPT)
+                stat2 = prompt(STAT_PROMPT)
+                try:
+                    ba.graph_stat_by_stat(stat1, stat2)
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Stat(s)")
+            elif command == "graph-team-comparison":
+                team_name1 = prompt("Enter first team name: ")
+                team_name2 = prompt("Enter second team name: ")
+                try:
+                    team_abbrev1 = ba.name_to_abbrev(team_name1)
+                    team_abbrev2 = ba.name_to_abbrev(team_name2)
+                    ba.graph_team_comparison(team_abbrev1, team_abbrev2)
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Team Name(s)")
+            elif command == "find-player":
+                prefix = prompt("Input the start of a player's name: ")
+                print(ba.find_players(prefix))
+            elif command == "search-player":
+                name = prompt("Input a player's name (Last, First): ")
+                print(ba.search_players(name))
+            elif command == "get-load-time":
+                source, seconds = ba.get_load_time()
+                print(("Loaded the batters' stats from %s in %.3f seconds") % \
+                      (source, seconds))
+            elif command == "get-memory-usage":
+                print(ba.get_memory_usage())
+            elif command == "get-seasons":
+                print(ba.get_seasons())
+            elif command == "get-career-stats":
+                lastn = prompt("Input player's last name: ")
+                firstn = prompt("Input player's first name: ")
+                try:
+                    print(ba.get_career_stats(lastn, firstn))
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Player Name")
+            elif command == "get-division-standings":
+                try:
+                    print(ba.get_division_standings())
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("No Game Results")
+            elif command == "get-playoff-odds":
+                num_simulations = prompt("Enter the number of simulated " + \
+                                         "seasons: ")
+                seed = prompt("Enter a random seed (or 'random'): ")
+                try:
+                    seed = None if seed.lower() == 'random' else int(seed)
+                    print(ba.get_playoff_odds(int(num_simulations), seed))
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Simulations or Seed, or No Game Results")
+            elif command == "get-similar-players":
+                lastn = prompt("Input player's last name: ")
+                firstn = prompt("Input player's first name: ")
+                k = prompt("Enter the number of similar players: ")
+                min_ab = prompt("Enter the fewest at bats they can have: ")
+                try:
+                    print(ba.get_similar_players(lastn, firstn, int(k), \
+                                                 int(min_ab)))
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Player Name, K or Min AB")
+            elif command in ("get-stat-interval", "get-team-stat-intervals"):
+                summary = prompt("Enter a summary (mean, median or std): ")
+                if command == "get-stat-interval":
+                    stat = ba.get_stat_name(prompt(STAT_PROMPT))
+                num_resamples = prompt("Enter the number of resamples: ")
+                seed = prompt("Enter a random seed (or 'random'): ")
+                try:
+                    seed = None if seed.lower() == 'random' else int(seed)
+                    if command == "get-stat-interval":
+                        print(ba.get_stat_interval(stat, summary.lower(), \
+                                                   int(num_resamples), \
+                                                   seed = seed))
+                    else:
+                        print(ba.get_team_stat_intervals(summary.lower(), \
+                              int(num_resamples), seed = seed))
+                except Exception as error:
+                    instrumentation.record_error('command:' + command, error)
+                    print("Invalid Summary, Stat, Resamples or Seed")
+            elif command == "list-of-commands":
+                print("Here is a list of the program commands: \n" + \
+                      " 'Get-Standings' \n" + \
+                      " 'Get-Roster' \n" + \
+                      " 'Get-Player-Stats' \n" + \
+                      " 'Get-Avg-Team-Stats' \n" + \
+                      " 'Get-Med-Team-Stats' \n" + \
+                      " 'Get-Std-Team-Stats' \n" + \
+                      " 'Get-Mean-Stat' \n" + \
+                      " 'Get-Median-Stat' \n" + \
+                      " 'Get-Std-Stat' \n" + \
+                      " 'Get-Max-Stat-Player' \n" + \
+                      " 'Get-Quantile-Stat' \n" + \
+                      " 'Get-Player-Quantile' \n" + \
+                      " 'Graph-Team-By-Stat' \n" + \
+                      " 'Graph-Stat-By-Stat' \n" + \
+                      " 'Graph-Team-Comparison' \n" + \
+                      " 'Find-Player' \n" + \
+                      " 'Search-Player' \n" + \
+                      " 'Get-Load-Time' \n" + \
+                      " 'Get-Memory-Usage' \n" + \
+                      " 'Get-Seasons' \n" + \
+                      " 'Get-Career-Stats' \n" + \
+                      " 'Get-Division-Standings' \n" + \
+                      " 'Get-Playoff-Odds' \n" + \
+                      " 'Get-Similar-Players' \n" + \
+                      " 'Get-Stat-Interval' \n" + \
+                      " 'Get-Team-Stat-Intervals' \n" + \
+                      " 'List-Of-Commands' ")
+            else:
+                print("Invalid Command")
         command = input("Enter a command: ")
         command = command.lower()
 
-main()
+if __name__ == '__main__':
+    main()